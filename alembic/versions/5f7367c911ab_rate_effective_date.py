@@ -0,0 +1,33 @@
+"""Rate effective date mapping
+
+Revision ID: 5f7367c911ab
+Revises: eb8c87b4cddc
+Create Date: 2026-10-18 16:05:12.481230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f7367c911ab'
+down_revision: Union[str, None] = 'eb8c87b4cddc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_effective_date',
+    sa.Column('requested_date', sa.Date(), nullable=False),
+    sa.Column('effective_date', sa.Date(), nullable=True),
+    sa.Column('checked_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('requested_date')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rate_effective_date')
@@ -0,0 +1,99 @@
+"""Partition currency_rate by year, BRIN index on date
+
+Revision ID: 9b6e2f4a7c13
+Revises: e5a1c3d7f902
+Create Date: 2026-10-18 19:42:17.830514
+
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b6e2f4a7c13'
+down_revision: Union[str, None] = 'e5a1c3d7f902'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _serial_sequence(table: str) -> str | None:
+    return op.get_bind().scalar(sa.text(f"SELECT pg_get_serial_sequence('{table}', 'id')"))
+
+
+def _create_indexes(partitioned: bool) -> None:
+    op.create_index('idx_date_currency', 'currency_rate', ['date', 'currency_code'], unique=True)
+    op.create_index(
+        'idx_currency_date', 'currency_rate', ['currency_code', 'date'],
+        postgresql_include=['rate', 'nominal'],
+    )
+    if partitioned:
+        op.create_index(
+            'idx_currency_rate_date_brin', 'currency_rate', ['date'],
+            postgresql_using='brin', postgresql_with={'pages_per_range': 8},
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema.
+
+    Таблица пересоздаётся как секционированная и заполняется копией
+    данных: на время миграции запись и чтение курсов блокируются.
+    """
+    sequence = _serial_sequence('currency_rate')
+    op.rename_table('currency_rate', 'currency_rate_old')
+
+    # Те же колонки, NOT NULL и nextval для id
+    op.execute("""
+        CREATE TABLE currency_rate (LIKE currency_rate_old INCLUDING DEFAULTS)
+        PARTITION BY RANGE (date)
+    """)
+
+    first_year, last_year = op.get_bind().execute(sa.text(
+        "SELECT extract(year FROM min(date))::int, extract(year FROM max(date))::int FROM currency_rate_old"
+    )).one()
+    # Секции на все годы с данными и на следующий год, дальше их заводит app.partitions
+    next_year = date.today().year + 1
+    for year in range((first_year or next_year - 1), max(last_year or 0, next_year) + 1):
+        op.execute(
+            f"CREATE TABLE currency_rate_y{year} PARTITION OF currency_rate "
+            f"FOR VALUES FROM ('{year:04d}-01-01') TO ('{year + 1:04d}-01-01')"
+        )
+
+    # По порядку дат: на этом держится BRIN
+    op.execute("""
+        INSERT INTO currency_rate (id, date, currency_code, name, rate, nominal)
+        SELECT id, date, currency_code, name, rate, nominal
+        FROM currency_rate_old
+        ORDER BY date, currency_code
+    """)
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY currency_rate.id")
+    op.drop_table('currency_rate_old')
+
+    # Индексы - после загрузки, так быстрее
+    op.create_primary_key('currency_rate_pkey', 'currency_rate', ['id', 'date'])
+    _create_indexes(partitioned=True)
+    op.execute("ANALYZE currency_rate")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    sequence = _serial_sequence('currency_rate')
+    op.execute("CREATE TABLE currency_rate_plain (LIKE currency_rate INCLUDING DEFAULTS)")
+    op.execute("""
+        INSERT INTO currency_rate_plain (id, date, currency_code, name, rate, nominal)
+        SELECT id, date, currency_code, name, rate, nominal
+        FROM currency_rate
+        ORDER BY id
+    """)
+    if sequence:
+        op.execute(f"ALTER SEQUENCE {sequence} OWNED BY currency_rate_plain.id")
+    # Вместе с секциями
+    op.drop_table('currency_rate')
+    op.rename_table('currency_rate_plain', 'currency_rate')
+
+    op.create_primary_key('currency_rate_pkey', 'currency_rate', ['id'])
+    _create_indexes(partitioned=False)
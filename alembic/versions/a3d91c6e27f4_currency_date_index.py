@@ -0,0 +1,41 @@
+"""Currency-first index for rate history
+
+Revision ID: a3d91c6e27f4
+Revises: 5f7367c911ab
+Create Date: 2026-10-18 16:21:37.904615
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3d91c6e27f4'
+down_revision: Union[str, None] = '5f7367c911ab'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в currency_rate, но не работает
+    # внутри транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'idx_currency_date', 'currency_rate', ['currency_code', 'date'],
+            unique=False,
+            postgresql_include=['rate', 'nominal'],
+            postgresql_concurrently=True,
+            if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'idx_currency_date', table_name='currency_rate',
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
@@ -0,0 +1,44 @@
+"""Rate snapshot hashes for HTTP validators
+
+Revision ID: c81f5b0d4e92
+Revises: a3d91c6e27f4
+Create Date: 2026-10-18 16:58:03.117442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f5b0d4e92'
+down_revision: Union[str, None] = 'a3d91c6e27f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_snapshot',
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('etag', sa.String(length=32), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('date')
+    )
+    # Хэши для уже загруженных дат, тем же выражением, что в crud.save_rates
+    op.execute("""
+        INSERT INTO rate_snapshot (date, etag)
+        SELECT date,
+               md5(string_agg(
+                   concat_ws('|', date, currency_code, name, rate, nominal), ';'
+                   ORDER BY currency_code
+               ))
+        FROM currency_rate
+        GROUP BY date
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rate_snapshot')
@@ -0,0 +1,106 @@
+"""Rate rollups: daily change, monthly and yearly aggregates
+
+Revision ID: e5a1c3d7f902
+Revises: c81f5b0d4e92
+Create Date: 2026-10-18 18:20:41.506213
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a1c3d7f902'
+down_revision: Union[str, None] = 'c81f5b0d4e92'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rate_daily_change',
+    sa.Column('currency_code', sa.String(length=3), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('prev_date', sa.Date(), nullable=True),
+    sa.Column('change', sa.Numeric(precision=20, scale=10), nullable=True),
+    sa.Column('change_pct', sa.Float(), nullable=True),
+    sa.Column('log_return', sa.Float(), nullable=True),
+    sa.Column('volatility', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('currency_code', 'date')
+    )
+    op.create_table('rate_period_stats',
+    sa.Column('currency_code', sa.String(length=3), nullable=False),
+    sa.Column('period', sa.String(length=5), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('days', sa.Integer(), nullable=False),
+    sa.Column('first_date', sa.Date(), nullable=False),
+    sa.Column('last_date', sa.Date(), nullable=False),
+    sa.Column('open_value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('close_value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('min_value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('max_value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('avg_value', sa.Numeric(precision=20, scale=10), nullable=False),
+    sa.Column('sum_value', sa.Numeric(precision=30, scale=10), nullable=False),
+    sa.Column('returns', sa.Integer(), nullable=False),
+    sa.Column('sum_return', sa.Float(), nullable=True),
+    sa.Column('sum_return_sq', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('currency_code', 'period', 'period_start')
+    )
+
+    # Статистика по уже загруженным курсам, теми же выражениями, что в
+    # app.rollups.rebuild_rollups (окно волатильности - 30 дат)
+    op.execute("""
+        INSERT INTO rate_daily_change
+            (currency_code, date, value, prev_date, change, change_pct, log_return, volatility)
+        SELECT currency_code, date, value, prev_date, change, change_pct, log_return,
+               stddev_samp(log_return) OVER (
+                   PARTITION BY currency_code ORDER BY date
+                   ROWS BETWEEN 29 PRECEDING AND CURRENT ROW
+               )
+        FROM (
+            SELECT currency_code, date, value, prev_date,
+                   value - prev_value AS change,
+                   CASE WHEN prev_value > 0 THEN (value / prev_value - 1) * 100 END AS change_pct,
+                   CASE WHEN prev_value > 0 AND value > 0 THEN ln((value / prev_value)::float8) END AS log_return
+            FROM (
+                SELECT currency_code, date, round(rate / nominal, 10) AS value,
+                       lag(date) OVER w AS prev_date,
+                       lag(round(rate / nominal, 10)) OVER w AS prev_value
+                FROM currency_rate
+                WHERE rate IS NOT NULL AND nominal > 0
+                WINDOW w AS (PARTITION BY currency_code ORDER BY date)
+            ) lagged
+        ) changes
+    """)
+    op.execute("""
+        INSERT INTO rate_period_stats
+        SELECT d.currency_code, 'month', date_trunc('month', d.date)::date,
+               count(*), min(d.date), max(d.date),
+               (array_agg(d.value ORDER BY d.date))[1],
+               (array_agg(d.value ORDER BY d.date DESC))[1],
+               min(d.value), max(d.value), round(avg(d.value), 10), sum(d.value),
+               count(d.log_return), sum(d.log_return), sum(d.log_return * d.log_return)
+        FROM rate_daily_change d
+        GROUP BY d.currency_code, date_trunc('month', d.date)
+    """)
+    op.execute("""
+        INSERT INTO rate_period_stats
+        SELECT m.currency_code, 'year', date_trunc('year', m.period_start)::date,
+               sum(m.days), min(m.first_date), max(m.last_date),
+               (array_agg(m.open_value ORDER BY m.period_start))[1],
+               (array_agg(m.close_value ORDER BY m.period_start DESC))[1],
+               min(m.min_value), max(m.max_value), round(sum(m.sum_value) / sum(m.days), 10), sum(m.sum_value),
+               sum(m.returns), sum(m.sum_return), sum(m.sum_return_sq)
+        FROM rate_period_stats m
+        WHERE m.period = 'month'
+        GROUP BY m.currency_code, date_trunc('year', m.period_start)
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rate_period_stats')
+    op.drop_table('rate_daily_change')
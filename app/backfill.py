@@ -0,0 +1,301 @@
+"""Загрузка исторических курсов ЦБ за диапазон дат.
+
+    python -m app.backfill 2015-01-01 2024-12-31 --concurrency 8 --rps 10
+    python -m app.backfill 2000-01-01 2024-12-31 --mode dynamic
+
+Режим daily запрашивает XML_daily на каждый день, dynamic - XML_dynamic по
+каждой валюте из справочника ЦБ (меньше запросов на длинных диапазонах,
+но только валюты, которые есть в текущем справочнике). Полученные курсы
+пишутся пачками через COPY, после чего статистика (app.rollups)
+перестраивается целиком. Уже загруженные даты (и выходные, для которых
+известна дата курсов ЦБ) пропускаются, поэтому прерванный запуск можно
+просто повторить.
+"""
+import argparse
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+
+from sqlalchemy import func, select
+
+from app.cbr_client import cbr_client
+from app.crud import copy_rates, save_effective_dates
+from app.database import AsyncSessionLocal, init_db, shutdown_db
+from app.models import CurrencyRate, EffectiveDate
+from app.rollups import rebuild_rollups
+from app.utils import fetch_cbr_currencies, fetch_cbr_dynamic, fetch_cbr_rates
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class RateLimiter:
+    """Не больше rate запусков в секунду, равномерно."""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if not self._interval:
+            return
+
+        async with self._lock:
+            now = time.monotonic()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+            self._next = max(now, self._next) + self._interval
+
+
+@dataclass
+class BackfillStats:
+    requests: int = 0
+    failed: int = 0
+    days: set = field(default_factory=set)
+    rows: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def report(self) -> dict:
+        elapsed = self.elapsed or 1e-9
+        return {
+            'requests': self.requests,
+            'failed': self.failed,
+            'days': len(self.days),
+            'rows': self.rows,
+            'seconds': round(self.elapsed, 2),
+            'days_per_sec': round(len(self.days) / elapsed, 2),
+            'rows_per_sec': round(self.rows / elapsed, 1),
+        }
+
+
+def _date_range(start: date, end: date):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+async def _existing_dates(start: date, end: date) -> set[date]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(CurrencyRate.date).where(CurrencyRate.date.between(start, end))
+            .union(
+                # Дата без курсов (NULL) не считается загруженной: пустой
+                # ответ мог быть временным, такие даты запрашиваются снова
+                select(EffectiveDate.requested_date)
+                .where(
+                    EffectiveDate.requested_date.between(start, end),
+                    EffectiveDate.effective_date.is_not(None),
+                )
+            )
+        )
+        return set(result.scalars().all())
+
+
+async def _last_dates_by_currency(start: date, end: date) -> dict[str, date]:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(CurrencyRate.currency_code, func.max(CurrencyRate.date))
+            .where(CurrencyRate.date.between(start, end))
+            .group_by(CurrencyRate.currency_code)
+        )
+        return dict(result.all())
+
+
+async def _writer(queue: asyncio.Queue, stats: BackfillStats, flush_rows: int) -> None:
+    buffer = []
+    effective_dates = {}
+    today = date.today()
+
+    async def flush():
+        async with AsyncSessionLocal() as session:
+            if buffer:
+                saved = await copy_rates(session, buffer)
+                if not saved:
+                    raise RuntimeError("Failed to write backfill batch")
+                stats.rows += saved
+                stats.days.update(rate.date for rate in buffer)
+
+            # Соответствия пишем после курсов: иначе при обрыве выходной
+            # будет пропущен при повторе, а курсы на его дату не загружены
+            await save_effective_dates(session, effective_dates)
+
+        buffer.clear()
+        effective_dates.clear()
+        logger.info(f"Backfill progress: {stats.report()}")
+
+    while True:
+        item = await queue.get()
+        if item is _DONE:
+            break
+
+        requested_date, cbr_date, rates = item
+        if (requested_date is not None and cbr_date is not None
+                and requested_date != cbr_date and requested_date <= today):
+            effective_dates[requested_date] = cbr_date
+        buffer.extend(rates)
+        if len(buffer) >= flush_rows:
+            await flush()
+
+    await flush()
+
+
+async def _fetch_daily(start, end, queue, stats, concurrency, limiter) -> None:
+    existing = await _existing_dates(start, end)
+    pending = [day for day in _date_range(start, end) if day not in existing]
+    logger.info(f"Backfill daily: {len(pending)} dates to fetch")
+
+    # На выходные ЦБ отдаёт курсы предыдущего рабочего дня - не пишем их повторно
+    seen = set(existing)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_day(day: date):
+        async with semaphore:
+            await limiter.acquire()
+            stats.requests += 1
+            try:
+                rates = await fetch_cbr_rates(day)
+            except Exception as e:
+                stats.failed += 1
+                logger.warning(f"Failed to fetch rates for {day}: {e}")
+                return
+
+        if not rates:
+            # None - 403/429 или битый XML; пустой документ тоже не пишем:
+            # при повторе такая дата была бы пропущена навсегда
+            stats.failed += 1
+            logger.warning(f"No rates received for {day}, will retry on the next run")
+            return
+
+        cbr_date = rates[0].date
+        if cbr_date in seen:
+            rates = []
+        seen.add(cbr_date)
+        await queue.put((day, cbr_date, rates))
+
+    await asyncio.gather(*(fetch_day(day) for day in pending))
+
+
+async def _fetch_dynamic(start, end, queue, stats, concurrency, limiter, chunk_days) -> None:
+    currencies = await fetch_cbr_currencies()
+    last_dates = await _last_dates_by_currency(start, end)
+    logger.info(f"Backfill dynamic: {len(currencies)} currencies")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_currency(currency: dict):
+        # Куски по валюте пишутся по порядку, поэтому продолжаем с последней даты
+        last_date = last_dates.get(currency['currency_code'])
+        chunk_start = max(start, last_date + timedelta(days=1)) if last_date else start
+
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=chunk_days - 1))
+            async with semaphore:
+                await limiter.acquire()
+                stats.requests += 1
+                try:
+                    rates = await fetch_cbr_dynamic(currency, chunk_start, chunk_end)
+                except Exception as e:
+                    stats.failed += 1
+                    logger.warning(f"Failed to fetch {currency['currency_code']} for {chunk_start}..{chunk_end}: {e}")
+                    return
+
+            if rates:
+                await queue.put((None, None, rates))
+            chunk_start = chunk_end + timedelta(days=1)
+
+    await asyncio.gather(*(fetch_currency(currency) for currency in currencies))
+
+
+async def backfill(
+    start: date,
+    end: date,
+    mode: str = 'daily',
+    concurrency: int = 4,
+    rps: float = 5.0,
+    flush_rows: int = 20000,
+    chunk_days: int = 366,
+    rebuild: bool = True,
+) -> dict:
+    stats = BackfillStats()
+    limiter = RateLimiter(rps)
+    # Ограниченная очередь: загрузка не уходит далеко вперёд записи
+    queue = asyncio.Queue(maxsize=concurrency * 4)
+
+    if mode == 'dynamic':
+        fetcher = _fetch_dynamic(start, end, queue, stats, concurrency, limiter, chunk_days)
+    else:
+        fetcher = _fetch_daily(start, end, queue, stats, concurrency, limiter)
+
+    producer = asyncio.create_task(fetcher)
+    writer = asyncio.create_task(_writer(queue, stats, flush_rows))
+    try:
+        # Если запись упала, загрузка не должна висеть на заполненной очереди
+        await asyncio.wait({producer, writer}, return_when=asyncio.FIRST_COMPLETED)
+        if writer.done():
+            writer.result()
+        await producer
+        await queue.put(_DONE)
+        await writer
+    finally:
+        producer.cancel()
+        writer.cancel()
+
+    # COPY не обновляет статистику по датам: после загрузки она строится заново
+    if rebuild and stats.rows:
+        async with AsyncSessionLocal() as session:
+            await rebuild_rollups(session)
+
+    report = stats.report()
+    logger.info(f"Backfill finished: {report}")
+    return report
+
+
+def _parse_date(value: str) -> date:
+    return date.fromisoformat(value)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('start', type=_parse_date)
+    parser.add_argument('end', type=_parse_date)
+    parser.add_argument('--mode', choices=['daily', 'dynamic'], default='daily')
+    parser.add_argument('--concurrency', type=int, default=4, help="одновременных запросов к ЦБ")
+    parser.add_argument('--rps', type=float, default=5.0, help="не больше запросов в секунду, 0 - без ограничения")
+    parser.add_argument('--flush-rows', type=int, default=20000, help="строк в одной записи COPY")
+    parser.add_argument('--chunk-days', type=int, default=366, help="дней в одном запросе XML_dynamic")
+    parser.add_argument('--skip-rollups', action='store_true',
+                        help="не перестраивать статистику (если следом идёт ещё один запуск)")
+    args = parser.parse_args()
+
+    await init_db()
+    # Пул соединений не меньше числа одновременных запросов
+    cbr_client.pool_size = max(cbr_client.pool_size, args.concurrency)
+    await cbr_client.start()
+    try:
+        report = await backfill(
+            args.start, args.end, args.mode, args.concurrency, args.rps, args.flush_rows, args.chunk_days,
+            rebuild=not args.skip_rollups,
+        )
+    finally:
+        await cbr_client.close()
+        await shutdown_db()
+
+    print(
+        f"{report['days']} days, {report['rows']} rows in {report['seconds']}s: "
+        f"{report['days_per_sec']} days/sec, {report['rows_per_sec']} rows/sec "
+        f"({report['requests']} requests, {report['failed']} failed)"
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+import json
+import os
+import time
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Mapping, Sequence
+
+logger = logging.getLogger(__name__)
+
+RATE_CACHE_SIZE = int(os.getenv("RATE_CACHE_SIZE", "512"))
+RATE_CACHE_TODAY_TTL = float(os.getenv("RATE_CACHE_TODAY_TTL", "60"))
+# Сколько помнить, что курсов на дату нет, секунды
+RATE_NEGATIVE_TTL = float(os.getenv("RATE_NEGATIVE_TTL", "300"))
+
+
+class RateSet:
+    """Полный набор курсов ЦБ на одну дату.
+
+    date - фактическая дата курсов ЦБ, она может быть раньше запрошенной.
+    Пустой набор означает, что курсов на запрошенную дату нет.
+    etag и last_modified - из rate_snapshot, для условных HTTP-запросов.
+    rates - строки с ключами date, currency_code, name, rate, nominal:
+    словари или asyncpg.Record прямо из app.queries.
+    """
+
+    __slots__ = ('date', 'rates', 'by_code', 'etag', 'last_modified', '_json', '_json_by_code')
+
+    def __init__(
+        self,
+        target_date: date,
+        rates: Sequence[Mapping],
+        etag: str | None = None,
+        last_modified: datetime | None = None,
+    ):
+        self.date = target_date
+        self.rates = rates
+        self.by_code = {rate['currency_code']: rate for rate in rates}
+        self.etag = etag
+        self.last_modified = last_modified
+        self._json: bytes | None = None
+        self._json_by_code: dict[str, bytes] = {}
+
+    def json(self) -> bytes:
+        """Готовое тело ответа со всеми курсами; кодируется один раз."""
+        if self._json is None:
+            self._json = _dumps([_encodable(rate) for rate in self.rates])
+        return self._json
+
+    def json_for(self, currency_code: str) -> bytes | None:
+        encoded = self._json_by_code.get(currency_code)
+        if encoded is None:
+            rate = self.by_code.get(currency_code)
+            if rate is None:
+                return None
+            encoded = self._json_by_code[currency_code] = _dumps(_encodable(rate))
+        return encoded
+
+
+def _encodable(rate: dict) -> dict:
+    # Тот же вид, что давал CurrencyRateSchema: дата строкой, курс числом
+    return {
+        'date': rate['date'].isoformat(),
+        'currency_code': rate['currency_code'],
+        'name': rate['name'],
+        'rate': float(rate['rate']),
+        'nominal': rate['nominal'],
+    }
+
+
+def _dumps(content) -> bytes:
+    # Параметры как у JSONResponse, чтобы байты ответа не изменились
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':')).encode('utf-8')
+
+
+class RateCache:
+    """LRU-кэш наборов курсов по дате.
+
+    Прошлые даты не устаревают (ЦБ их уже не меняет), сегодняшняя и будущие
+    живут не дольше today_ttl секунд.
+    """
+
+    def __init__(self, maxsize: int = RATE_CACHE_SIZE, today_ttl: float = RATE_CACHE_TODAY_TTL):
+        self.maxsize = maxsize
+        self.today_ttl = today_ttl
+        self._entries: OrderedDict[date, tuple[RateSet, float | None]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, target_date: date) -> RateSet | None:
+        entry = self._entries.get(target_date)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        rate_set, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[target_date]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(target_date)
+        self.hits += 1
+        return rate_set
+
+    def put(self, target_date: date, rate_set: RateSet, ttl: float | None = None) -> None:
+        expires_at = None
+        if ttl is not None:
+            expires_at = time.monotonic() + ttl
+        elif target_date >= date.today():
+            expires_at = time.monotonic() + self.today_ttl
+
+        self._entries[target_date] = (rate_set, expires_at)
+        self._entries.move_to_end(target_date)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, target_date: date | None = None) -> list[date]:
+        """Удаляет записи на дату и возвращает их ключи."""
+        if target_date is None:
+            stale = list(self._entries)
+            self._entries.clear()
+            return stale
+
+        # Выходные и праздники ссылаются на набор предыдущего рабочего дня
+        stale = [
+            key for key, (rate_set, _) in self._entries.items()
+            if key == target_date or rate_set.date == target_date
+        ]
+        for key in stale:
+            del self._entries[key]
+        return stale
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
+
+
+rate_cache = RateCache()
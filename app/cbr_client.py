@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+from app.metrics import cbr_failures, cbr_request_duration, cbr_retries, registry
+
+logger = logging.getLogger(__name__)
+
+CBR_BASE_URL = os.getenv("CBR_BASE_URL", "https://www.cbr.ru/scripts")
+# Таймаут одной попытки и общий бюджет на запрос вместе с повторами, секунды
+CBR_TIMEOUT = float(os.getenv("CBR_TIMEOUT", "5"))
+CBR_DEADLINE = float(os.getenv("CBR_DEADLINE", "15"))
+CBR_MAX_RETRIES = int(os.getenv("CBR_MAX_RETRIES", "3"))
+CBR_BACKOFF_BASE = float(os.getenv("CBR_BACKOFF_BASE", "0.2"))
+CBR_BACKOFF_MAX = float(os.getenv("CBR_BACKOFF_MAX", "3"))
+CBR_POOL_SIZE = int(os.getenv("CBR_POOL_SIZE", "20"))
+CBR_BREAKER_THRESHOLD = int(os.getenv("CBR_BREAKER_THRESHOLD", "5"))
+CBR_BREAKER_RESET = float(os.getenv("CBR_BREAKER_RESET", "30"))
+
+
+class CBRUnavailableError(Exception):
+    """ЦБ не ответил за отведённые попытки или цепь разомкнута."""
+
+
+class CircuitOpenError(CBRUnavailableError):
+    pass
+
+
+class _RetryableStatus(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class CircuitBreaker:
+    """После threshold неудачных вызовов подряд отказывает сразу, не
+    обращаясь к ЦБ, пока не пройдёт reset_timeout. Затем пропускает один
+    пробный вызов: успех замыкает цепь, неудача размыкает снова."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold: int = CBR_BREAKER_THRESHOLD, reset_timeout: float = CBR_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started: float | None = None
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        # Пробный вызов, который так и не отчитался (например, отменён),
+        # не должен держать цепь полуоткрытой вечно
+        if self.state == self.HALF_OPEN and (
+            self._probe_started is None or now - self._probe_started >= self.reset_timeout
+        ):
+            self._probe_started = now
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_started = None
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"CBR circuit opened after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class CBRClient:
+    """Долгоживущий HTTP-клиент к ЦБ: пул keep-alive соединений, кэш DNS,
+    таймауты, повторы с экспоненциальной задержкой и circuit breaker."""
+
+    def __init__(
+        self,
+        base_url: str = CBR_BASE_URL,
+        timeout: float = CBR_TIMEOUT,
+        deadline: float = CBR_DEADLINE,
+        max_retries: int = CBR_MAX_RETRIES,
+        backoff_base: float = CBR_BACKOFF_BASE,
+        backoff_max: float = CBR_BACKOFF_MAX,
+        pool_size: int = CBR_POOL_SIZE,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker()
+        self._session: aiohttp.ClientSession | None = None
+
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.statuses: dict[int, int] = {}
+        self._latencies = deque(maxlen=1000)
+
+    async def start(self) -> None:
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+        logger.info(f"CBR client started for {self.base_url}")
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+            logger.info("CBR client closed")
+
+    def _backoff(self, attempt: int) -> float:
+        # full jitter: случайная задержка до экспоненциального потолка
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def fetch(
+        self,
+        path: str,
+        params: dict | None = None,
+        consume: Callable[[aiohttp.ClientResponse], Awaitable[Any]] | None = None,
+    ) -> Any:
+        """GET {base_url}/{path}. При 200 - тело ответа или результат
+        consume(response), если он передан (потоковый разбор); None при 4xx.
+
+        5xx, ошибки соединения и таймауты (в том числе при чтении тела)
+        повторяются в пределах бюджета deadline, после чего поднимается
+        CBRUnavailableError. consume вызывается заново на каждой попытке.
+        """
+        if self._session is None or self._session.closed:
+            await self.start()
+
+        self.requests += 1
+        if not self.breaker.allow():
+            self.short_circuited += 1
+            cbr_failures.inc(path, "circuit_open")
+            raise CircuitOpenError("CBR circuit is open")
+
+        url = f"{self.base_url}/{path}"
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            self.attempts += 1
+            started = time.monotonic()
+            try:
+                async with self._session.get(
+                    url,
+                    params=params,
+                    timeout=aiohttp.ClientTimeout(total=max(0.001, min(self.timeout, remaining))),
+                ) as response:
+                    self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+                    if response.status >= 500:
+                        raise _RetryableStatus(response.status)
+
+                    if response.status != 200:
+                        cbr_request_duration.observe(time.monotonic() - started, path, response.status)
+                        self.breaker.record_success()
+                        logger.warning(f"CBR returned {response.status} for {url}")
+                        return None
+
+                    if consume is None:
+                        result = await response.read()
+                    else:
+                        result = await consume(response)
+                    elapsed = time.monotonic() - started
+                    self._latencies.append(elapsed)
+                    cbr_request_duration.observe(elapsed, path, 200)
+                    self.breaker.record_success()
+                    return result
+            except (aiohttp.ClientError, asyncio.TimeoutError, _RetryableStatus) as e:
+                elapsed = time.monotonic() - started
+                self._latencies.append(elapsed)
+                cbr_request_duration.observe(
+                    elapsed, path, e.status if isinstance(e, _RetryableStatus) else "error"
+                )
+                delay = self._backoff(attempt)
+                if attempt >= self.max_retries or time.monotonic() + delay >= deadline:
+                    self.failures += 1
+                    cbr_failures.inc(path, "exhausted")
+                    self.breaker.record_failure()
+                    raise CBRUnavailableError(f"CBR request failed: {e!r}") from e
+
+                attempt += 1
+                self.retries += 1
+                cbr_retries.inc(path)
+                logger.info(f"Retrying CBR request ({attempt}/{self.max_retries}) in {delay:.2f}s: {e!r}")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+        return {
+            'base_url': self.base_url,
+            'requests': self.requests,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'failures': self.failures,
+            'short_circuited': self.short_circuited,
+            'statuses': self.statuses,
+            'circuit': self.breaker.state,
+            'latency_ms': {
+                'p50': percentile(0.5),
+                'p95': percentile(0.95),
+                'max': percentile(1.0),
+            },
+        }
+
+
+cbr_client = CBRClient()
+
+_CIRCUIT_STATES = {CircuitBreaker.CLOSED: 0, CircuitBreaker.HALF_OPEN: 1, CircuitBreaker.OPEN: 2}
+registry.callback(
+    "cbr_circuit_state", "CBR circuit breaker state: 0 closed, 1 half-open, 2 open",
+    lambda: _CIRCUIT_STATES[cbr_client.breaker.state],
+)
@@ -0,0 +1,127 @@
+import logging
+import time
+from datetime import date
+from decimal import Decimal
+from typing import NamedTuple
+
+from lxml import etree
+
+from app.metrics import cbr_parse_duration
+
+logger = logging.getLogger(__name__)
+
+# Размер куска при чтении ответа ЦБ
+PARSE_CHUNK_SIZE = 64 * 1024
+
+
+class RateRecord(NamedTuple):
+    """Курс одной валюты на дату. Порядок полей совпадает с колонками COPY."""
+    date: date
+    currency_code: str
+    name: str
+    rate: Decimal
+    nominal: int
+
+
+def _parse_cbr_date(value: str) -> date:
+    # ДД.ММ.ГГГГ, без strptime - он заметно медленнее на длинных диапазонах
+    return date(int(value[6:10]), int(value[3:5]), int(value[0:2]))
+
+
+class CBRParser:
+    """Потоковый разбор XML_daily и XML_dynamic.
+
+    Принимает сырые байты ответа кусками (кодировку libxml2 берёт из
+    XML-декларации) и отдаёт готовые записи по мере разбора. Разобранные
+    элементы сразу удаляются из дерева, поэтому память не растёт с
+    размером документа.
+
+    XML_dynamic не содержит кода и названия валюты, их передают в currency
+    (элемент из fetch_cbr_currencies).
+    """
+
+    def __init__(self, currency: dict | None = None):
+        self.currency = currency
+        self.date: date | None = None
+        # События только на закрытие записей: поля читаем из дочерних
+        # элементов, а дату документа - из уже открытого корня
+        self._parser = etree.XMLPullParser(events=('end',), tag=('Valute', 'Record'))
+
+    def feed(self, chunk: bytes) -> list[RateRecord]:
+        self._parser.feed(chunk)
+        return self._drain()
+
+    def close(self) -> list[RateRecord]:
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self) -> list[RateRecord]:
+        records = []
+        for _, elem in self._parser.read_events():
+            parent = elem.getparent()
+            if self.date is None and parent.get('Date'):
+                self.date = _parse_cbr_date(parent.get('Date'))
+
+            record = self._build_record(elem)
+            if record is not None:
+                records.append(record)
+
+            # Освобождаем разобранное: сам элемент и уже пройденных соседей
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+        return records
+
+    def _build_record(self, elem) -> RateRecord | None:
+        tag = elem.tag
+        fields = {child.tag: child.text for child in elem}
+        try:
+            if tag == 'Valute':
+                record_date = self.date
+                currency_code = fields['CharCode'].strip()
+                name = (fields.get('Name') or '').strip()
+            else:
+                record_date = _parse_cbr_date(elem.get('Date'))
+                currency_code = self.currency['currency_code']
+                name = self.currency['name']
+            if record_date is None:
+                raise ValueError("no rate date in document")
+
+            return RateRecord(
+                record_date,
+                currency_code,
+                name,
+                Decimal(fields['Value'].replace(',', '.')),
+                int(fields.get('Nominal') or 1),
+            )
+        except Exception as e:
+            logger.warning(f"Skipping invalid {tag} in CBR response: {e!r}")
+            return None
+
+
+def parse_cbr_xml(data: bytes, currency: dict | None = None) -> list[RateRecord]:
+    """Разбор документа целиком (например, из файла)."""
+    parser = CBRParser(currency)
+    records = []
+    for start in range(0, len(data), PARSE_CHUNK_SIZE):
+        records.extend(parser.feed(data[start:start + PARSE_CHUNK_SIZE]))
+    records.extend(parser.close())
+    return records
+
+
+async def parse_cbr_response(response, currency: dict | None = None) -> list[RateRecord]:
+    """Разбор ответа aiohttp по мере поступления кусков."""
+    parser = CBRParser(currency)
+    records = []
+    # Считается только время разбора, без ожидания сети между кусками
+    parse_time = 0.0
+    async for chunk in response.content.iter_chunked(PARSE_CHUNK_SIZE):
+        started = time.perf_counter()
+        records.extend(parser.feed(chunk))
+        parse_time += time.perf_counter() - started
+    started = time.perf_counter()
+    records.extend(parser.close())
+    parse_time += time.perf_counter() - started
+    cbr_parse_duration.observe(parse_time, "dynamic" if currency else "daily")
+    return records
@@ -0,0 +1,101 @@
+import os
+import logging
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from app.cache import RateSet
+
+logger = logging.getLogger(__name__)
+
+CONVERSION_CACHE_SIZE = int(os.getenv("CONVERSION_CACHE_SIZE", "64"))
+# Курсы ЦБ даются к рублю, сам рубль в наборе отсутствует
+BASE_CURRENCY = "RUB"
+
+
+class RateVector:
+    """Курсы одной даты в виде плотного массива.
+
+    per_unit[i] - рублей за одну единицу валюты codes[i] (курс уже
+    поделён на номинал). Матрица кросс-курсов строится при первом
+    обращении: matrix[i, j] - единиц codes[j] за одну единицу codes[i].
+    """
+
+    __slots__ = ('date', 'codes', 'index', 'per_unit', '_matrix')
+
+    def __init__(self, rate_set: RateSet):
+        self.date = rate_set.date
+        self.codes = [BASE_CURRENCY] + [rate['currency_code'] for rate in rate_set.rates]
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.per_unit = np.array(
+            [1.0] + [float(rate['rate']) / (rate['nominal'] or 1) for rate in rate_set.rates],
+            dtype=np.float64,
+        )
+        self._matrix: np.ndarray | None = None
+
+    @property
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = self.per_unit[:, np.newaxis] / self.per_unit[np.newaxis, :]
+        return self._matrix
+
+    def positions(self, codes: list[str]) -> np.ndarray:
+        """Индексы валют в массиве, -1 для неизвестных кодов."""
+        index = self.index
+        return np.fromiter((index.get(code, -1) for code in codes), dtype=np.intp, count=len(codes))
+
+    def convert(self, from_codes: list[str], to_codes: list[str], amounts: np.ndarray) -> np.ndarray:
+        """Пересчёт массива сумм за один проход.
+
+        from_codes и to_codes - той же длины, что amounts, или из одного
+        элемента (тогда он применяется ко всем суммам). Для пар с
+        неизвестной валютой в результате NaN.
+        """
+        from_idx = self.positions(from_codes)
+        to_idx = self.positions(to_codes)
+        known = (from_idx >= 0) & (to_idx >= 0)
+
+        rates = np.where(known, self.matrix[from_idx, to_idx], np.nan)
+        return amounts * rates
+
+
+class ConversionEngine:
+    """LRU-кэш RateVector по фактической дате курсов ЦБ.
+
+    Вектор пересобирается, только если курсы в пришедшем RateSet
+    отличаются от тех, из которых он построен. Выходные дают отдельные
+    объекты RateSet с теми же курсами пятницы, и их достаточно сравнить.
+    """
+
+    def __init__(self, maxsize: int = CONVERSION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[date, tuple[RateSet, RateVector]] = OrderedDict()
+        self.builds = 0
+        self.evictions = 0
+
+    def vector(self, rate_set: RateSet) -> RateVector:
+        entry = self._entries.get(rate_set.date)
+        if entry is not None and (entry[0] is rate_set or entry[0].rates == rate_set.rates):
+            self._entries.move_to_end(rate_set.date)
+            return entry[1]
+
+        vector = RateVector(rate_set)
+        self.builds += 1
+        self._entries[rate_set.date] = (rate_set, vector)
+        self._entries.move_to_end(rate_set.date)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return vector
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'builds': self.builds,
+            'evictions': self.evictions,
+        }
+
+
+conversion_engine = ConversionEngine()
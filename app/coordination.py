@@ -0,0 +1,180 @@
+"""Согласование воркеров и узлов через Postgres.
+
+Загрузку курсов на дату выполняет один процесс из всех: остальные ждут
+его advisory-блокировку и берут сохранённое из базы. О записанных курсах
+save_rates сообщает через NOTIFY, а каждый воркер держит соединение с
+LISTEN и сбрасывает у себя устаревшие наборы, прогревая те, что были в кэше.
+"""
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+
+from app.cache import rate_cache
+from app.crud import RATES_CHANNEL, get_cached_rates, mark_written
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+RATES_LISTEN_ENABLED = os.getenv("RATES_LISTEN_ENABLED", "1") == "1"
+# Как долго ждать процесс, который уже загружает дату, секунды. Должно
+# быть больше CBR_DEADLINE, иначе ожидающие пойдут в ЦБ сами
+RATES_LOCK_TIMEOUT = float(os.getenv("RATES_LOCK_TIMEOUT", "30"))
+# Проверка LISTEN-соединения и пауза перед переподключением, секунды
+RATES_LISTEN_PING = float(os.getenv("RATES_LISTEN_PING", "30"))
+RATES_LISTEN_RETRY = float(os.getenv("RATES_LISTEN_RETRY", "5"))
+
+# Старшие 32 бита ключа блокировки загрузки, младшие - номер дня
+RATES_LOCK_NAMESPACE = 0x43425202
+
+
+def rates_lock_key(target_date: date) -> int:
+    return (RATES_LOCK_NAMESPACE << 32) | target_date.toordinal()
+
+
+def _parse_payload(payload: str) -> list[date]:
+    dates = []
+    for value in payload.split(","):
+        try:
+            dates.append(date.fromisoformat(value))
+        except ValueError:
+            logger.warning(f"Ignoring malformed {RATES_CHANNEL} payload item: {value!r}")
+    return dates
+
+
+class RatesListener:
+    """LISTEN на канал изменений курсов.
+
+    По уведомлению сбрасывает из кэша наборы на эти даты, а те, что были
+    в кэше, перечитывает в фоне. Пока соединения нет, уведомления теряются,
+    поэтому после переподключения кэш сбрасывается целиком.
+    """
+
+    def __init__(self, channel: str = RATES_CHANNEL, ping_interval: float = RATES_LISTEN_PING,
+                 retry_delay: float = RATES_LISTEN_RETRY):
+        self.channel = channel
+        self.ping_interval = ping_interval
+        self.retry_delay = retry_delay
+        self._task: asyncio.Task | None = None
+        self._warm_task: asyncio.Task | None = None
+        self._pending: set[date] = set()
+        self._warming: date | None = None
+
+        self.connected = False
+        self.connections = 0
+        self.notifications = 0
+        self.invalidated = 0
+        self.warmed = 0
+        self.last_notification: datetime | None = None
+        self.last_error: str | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Listening for rate updates on {self.channel}")
+
+    async def stop(self) -> None:
+        for task in (self._task, self._warm_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._warm_task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._listen()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.warning(f"Rate updates listener failed, reconnecting in {self.retry_delay}s: {e!r}")
+            finally:
+                self.connected = False
+
+            await asyncio.sleep(self.retry_delay)
+
+    async def _listen(self) -> None:
+        async with engine.connect() as conn:
+            raw = (await conn.get_raw_connection()).driver_connection
+            lost = asyncio.Event()
+            raw.add_termination_listener(lambda connection: lost.set())
+            await raw.add_listener(self.channel, self._on_notify)
+
+            if self.connections:
+                rate_cache.invalidate()
+                logger.info("Rate updates listener reconnected, local cache reset")
+            self.connections += 1
+            self.connected = True
+            self.last_error = None
+
+            try:
+                while not lost.is_set():
+                    try:
+                        await asyncio.wait_for(lost.wait(), self.ping_interval)
+                    except asyncio.TimeoutError:
+                        # Обрыв без закрытия сокета сам не обнаружится
+                        await asyncio.wait_for(raw.execute("SELECT 1"), self.ping_interval)
+            finally:
+                if raw.is_closed():
+                    await conn.invalidate()
+                else:
+                    # Соединение вернётся в пул, LISTEN на нём не нужен
+                    await asyncio.shield(raw.remove_listener(self.channel, self._on_notify))
+
+            raise ConnectionError("LISTEN connection lost")
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        self.notifications += 1
+        self.last_notification = datetime.now()
+
+        stale = []
+        changed_dates = _parse_payload(payload)
+        for changed in changed_dates:
+            stale.extend(rate_cache.invalidate(changed))
+        # Реплика может ещё не получить эти изменения
+        mark_written(changed_dates + stale)
+        # Дата, которая сейчас перечитывается, могла прочитаться до коммита
+        if self._warming is not None:
+            stale.append(self._warming)
+        self._schedule(stale)
+
+    def _schedule(self, stale: list[date]) -> None:
+        if not stale:
+            return
+        self.invalidated += len(stale)
+        self._pending.update(stale)
+        if self._warm_task is None or self._warm_task.done():
+            self._warm_task = asyncio.create_task(self._warm())
+
+    async def _warm(self) -> None:
+        while self._pending:
+            self._warming = self._pending.pop()
+            try:
+                rate_cache.invalidate(self._warming)
+                await get_cached_rates(self._warming, primary=True)
+                self.warmed += 1
+            except Exception as e:
+                logger.warning(f"Failed to warm rates for {self._warming}: {e!r}")
+            finally:
+                self._warming = None
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self._task is not None,
+            'channel': self.channel,
+            'connected': self.connected,
+            'connections': self.connections,
+            'notifications': self.notifications,
+            'invalidated': self.invalidated,
+            'warmed': self.warmed,
+            'last_notification': self.last_notification.isoformat() if self.last_notification else None,
+            'last_error': self.last_error,
+        }
+
+
+rates_listener = RatesListener()
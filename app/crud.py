@@ -1,50 +1,474 @@
-from sqlalchemy import select
+from sqlalchemy import Date, Integer, Numeric, String, bindparam, func, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.models import CurrencyRate
-from datetime import date
+from app.database import read_engine
+from app.models import CurrencyRate, EffectiveDate
+from app.cache import RATE_NEGATIVE_TTL, RateSet, rate_cache
+from app.cbr_parser import RateRecord
+from app.partitions import ensure_rate_partitions
+from app.queries import primary_queries, read_queries
+from app.rollups import refresh_rollups
+from datetime import date, datetime, timezone
+import asyncio
 import logging
-from decimal import Decimal
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.exc import IntegrityError
+import os
+import time
+from typing import AsyncIterator, Iterable, Mapping
+from sqlalchemy.dialects.postgresql import ARRAY, insert
 
 logger = logging.getLogger(__name__)
 
+# Один upsert на всю пачку: колонки передаются массивами и разворачиваются
+# через unnest, поэтому текст запроса не зависит от числа строк (кэшируется
+# как prepared statement) и нет лимита asyncpg на число параметров
+_unnest_rates = func.unnest(
+    bindparam('dates', type_=ARRAY(Date)),
+    bindparam('codes', type_=ARRAY(String)),
+    bindparam('names', type_=ARRAY(String)),
+    bindparam('rates', type_=ARRAY(Numeric)),
+    bindparam('nominals', type_=ARRAY(Integer)),
+).table_valued('date', 'currency_code', 'name', 'rate', 'nominal').render_derived()
+
+# Core-таблица, а не ORM-класс: иначе сессия выполнит запрос как ORM bulk insert
+_UPSERT_RATES = insert(CurrencyRate.__table__).from_select(
+    ['date', 'currency_code', 'name', 'rate', 'nominal'],
+    select(_unnest_rates),
+)
+_UPSERT_RATES = _UPSERT_RATES.on_conflict_do_update(
+    index_elements=['date', 'currency_code'],
+    set_={
+        'name': _UPSERT_RATES.excluded.name,
+        'rate': _UPSERT_RATES.excluded.rate,
+        'nominal': _UPSERT_RATES.excluded.nominal,
+    }
+)
+
+# Горячие чтения - готовым SQL через app.queries. Выходные и праздники
+# разрешаются в дату курсов через rate_effective_date прямо в запросе
+_SELECT_RATE_SET = """
+SELECT r.date, r.currency_code, r.name, r.rate, r.nominal, s.etag, s.updated_at
+FROM currency_rate r
+LEFT JOIN rate_snapshot s ON s.date = r.date
+WHERE r.date = coalesce(
+    (SELECT effective_date FROM rate_effective_date WHERE requested_date = $1), $1
+)
+ORDER BY r.currency_code
+"""
+
+_SELECT_EFFECTIVE_DATE = """
+SELECT effective_date, checked_at FROM rate_effective_date WHERE requested_date = $1
+"""
+
+_SELECT_VALIDATORS = """
+SELECT etag, updated_at
+FROM rate_snapshot
+WHERE date = coalesce(
+    (SELECT effective_date FROM rate_effective_date WHERE requested_date = $1), $1
+)
+"""
+
+# Пары (валюта, дата) для пакетного поиска разворачиваются через unnest
+_SELECT_PAIRS = """
+SELECT lookup.currency_code AS requested_code, lookup.date AS requested_date,
+       r.date, r.currency_code, r.name, r.rate, r.nominal
+FROM unnest($1::varchar[], $2::date[]) AS lookup (currency_code, date)
+LEFT JOIN rate_effective_date e ON e.requested_date = lookup.date
+JOIN currency_rate r
+  ON r.currency_code = lookup.currency_code
+ AND r.date = coalesce(e.effective_date, lookup.date)
+"""
+
+_SELECT_HISTORY = """
+SELECT date, rate, nominal
+FROM currency_rate
+WHERE currency_code = $1 AND date BETWEEN $2 AND $3
+ORDER BY date
+LIMIT $4
+"""
+
+# Сколько секунд после изменения даты читать её с основной базы: реплика
+# может отставать, и прочитанный с неё старый набор осел бы в кэше
+DB_READ_AFTER_WRITE = float(os.getenv("DB_READ_AFTER_WRITE", "5"))
+
+_written: dict[date, float] = {}
+
+# Хэш набора курсов за дату - основа ETag. Считается в той же транзакции,
+# что и запись курсов; updated_at (Last-Modified) сдвигается, только если
+# содержимое действительно изменилось
+_REFRESH_SNAPSHOTS = text("""
+INSERT INTO rate_snapshot (date, etag, updated_at)
+SELECT date,
+       md5(string_agg(
+           concat_ws('|', date, currency_code, name, rate, nominal), ';'
+           ORDER BY currency_code
+       )),
+       now()
+FROM currency_rate
+WHERE date = ANY(:dates)
+GROUP BY date
+ON CONFLICT (date) DO UPDATE SET
+    etag = EXCLUDED.etag,
+    updated_at = EXCLUDED.updated_at
+WHERE rate_snapshot.etag IS DISTINCT FROM EXCLUDED.etag
+RETURNING date
+""").bindparams(bindparam('dates', type_=ARRAY(Date)))
+
+# Канал уведомлений об изменившихся датах. Полезная нагрузка - даты в ISO
+# через запятую; для выходных и праздников - запрошенные даты
+RATES_CHANNEL = "rates_updated"
+# Лимит NOTIFY - 8000 байт, дат в одном уведомлении не больше
+NOTIFY_MAX_DATES = 500
+
+_NOTIFY = text("SELECT pg_notify(:channel, :payload)")
+
+# Сколько строк истории забирать из серверного курсора за раз
+HISTORY_FETCH_SIZE = 500
+# Сколько кусков вывода COPY держать в памяти на одну выгрузку
+EXPORT_COPY_QUEUE = 16
+
+# Фильтры выгрузки: NULL - без ограничения. asyncpg подставляет значения в
+# текст COPY литералами, так что лишние условия и секции отсекает планировщик
+_EXPORT_SELECT = """
+SELECT date, currency_code, name, rate, nominal
+FROM currency_rate
+WHERE ($1::varchar[] IS NULL OR currency_code = ANY($1::varchar[]))
+  AND ($2::date IS NULL OR date >= $2::date)
+  AND ($3::date IS NULL OR date <= $3::date)
+ORDER BY date, currency_code
+"""
+# JSON-строка - одно поле CSV. Разделитель и кавычка - управляющие символы,
+# которых в JSON не бывает, поэтому Postgres выводит строку как есть
+_JSON_COPY_OPTIONS = {'format': 'csv', 'delimiter': '\x02', 'quote': '\x01'}
+
+_STAGE_TABLE = "currency_rate_stage"
+_STAGE_COLUMNS = ('date', 'currency_code', 'name', 'rate', 'nominal')
+
+_CREATE_STAGE_SQL = f"""
+CREATE TEMP TABLE {_STAGE_TABLE} (
+    date date NOT NULL,
+    currency_code varchar(3) NOT NULL,
+    name varchar(100),
+    rate numeric(12, 6),
+    nominal integer
+) ON COMMIT DROP
+"""
+
+_MERGE_STAGE_SQL = f"""
+INSERT INTO currency_rate (date, currency_code, name, rate, nominal)
+SELECT DISTINCT ON (date, currency_code) date, currency_code, name, rate, nominal
+FROM {_STAGE_TABLE}
+ORDER BY date, currency_code
+ON CONFLICT (date, currency_code) DO UPDATE SET
+    name = EXCLUDED.name,
+    rate = EXCLUDED.rate,
+    nominal = EXCLUDED.nominal
+"""
+
 async def get_rates_by_date(session: AsyncSession, target_date: date):
     result = await session.execute(
         select(CurrencyRate).where(CurrencyRate.date == target_date)
     )
     return result.scalars().all()
 
-async def save_rates(session: AsyncSession, rates: list):
+def mark_written(dates: Iterable[date]) -> None:
+    """Следующие DB_READ_AFTER_WRITE секунд читать эти даты с основной базы."""
+    now = time.monotonic()
+    deadline = now + DB_READ_AFTER_WRITE
+    for written in dates:
+        _written[written] = deadline
+    if len(_written) > 10_000:  # после бэкфилла
+        for written, expires in list(_written.items()):
+            if expires <= now:
+                del _written[written]
+
+def _queries_for(target_date: date, primary: bool):
+    if not primary:
+        deadline = _written.get(target_date)
+        if deadline is None:
+            return read_queries
+        if deadline <= time.monotonic():
+            del _written[target_date]
+            return read_queries
+    return primary_queries
+
+async def get_cached_rates(target_date: date, primary: bool = False) -> RateSet | None:
+    """Набор курсов на календарную дату: из кэша или одним запросом к базе.
+
+    Выходные и праздники разрешаются в дату предыдущего рабочего дня через
+    rate_effective_date. Пустой RateSet - ЦБ недавно сообщил, что курсов
+    нет; None - в базе ничего не известно и стоит спросить ЦБ. primary -
+    читать с основной базы, а не с реплики: сразу после своей записи.
+    """
+    rate_set = rate_cache.get(target_date)
+    if rate_set is not None:
+        return rate_set
+
+    queries = _queries_for(target_date, primary)
+    rates = await queries.fetch(_SELECT_RATE_SET, target_date)
+
+    if rates:
+        rate_set = RateSet(
+            rates[0]['date'],
+            rates,
+            etag=rates[0]['etag'],
+            last_modified=rates[0]['updated_at'],
+        )
+        rate_cache.put(target_date, rate_set)
+        return rate_set
+
+    mapping = await queries.fetchrow(_SELECT_EFFECTIVE_DATE, target_date)
+    if mapping is not None and mapping['effective_date'] is None:
+        age = (datetime.now(timezone.utc) - mapping['checked_at']).total_seconds()
+        if age < RATE_NEGATIVE_TTL:
+            rate_set = RateSet(target_date, [])
+            rate_cache.put(target_date, rate_set, ttl=RATE_NEGATIVE_TTL - age)
+            return rate_set
+
+    return None
+
+async def get_rates_for_pairs(pairs: Iterable[tuple[str, date]]) -> dict[tuple[str, date], Mapping]:
+    """Курсы для множества пар (код валюты, календарная дата).
+
+    Даты, уже лежащие в кэше, отвечаются из него, остальные пары ищутся
+    одним запросом. Выходные разрешаются так же, как в get_cached_rates.
+    Ненайденных пар в результате нет.
+    """
+    pairs = set(pairs)
+    # Один поиск в кэше на дату, а не на пару: иначе счётчики попаданий
+    # и промахов растут на размер пакета
+    dates = {requested_date for _, requested_date in pairs}
+    cached = {requested_date: rate_cache.get(requested_date) for requested_date in dates}
+
+    found = {}
+    missing = []
+    for code, requested_date in pairs:
+        rate_set = cached[requested_date]
+        if rate_set is None:
+            missing.append((code, requested_date))
+        elif code in rate_set.by_code:
+            found[(code, requested_date)] = rate_set.by_code[code]
+
+    if missing:
+        rows = await read_queries.fetch(
+            _SELECT_PAIRS,
+            [code for code, _ in missing],
+            [requested_date for _, requested_date in missing],
+        )
+        for row in rows:
+            found[(row['requested_code'], row['requested_date'])] = row
+
+    return found
+
+async def stream_rate_history(
+    currency_code: str,
+    start: date,
+    end: date,
+    limit: int,
+) -> AsyncIterator[list]:
+    """История курса одной валюты за [start, end] по возрастанию даты.
+
+    Строки (date, rate, nominal) читаются серверным курсором пачками по
+    HISTORY_FETCH_SIZE. Для следующей страницы start - день после
+    последней полученной даты (keyset, без OFFSET). Соединение берётся
+    своё: генератор живёт дольше обработчика запроса.
+    """
+    async for rows in read_queries.cursor(
+        _SELECT_HISTORY, currency_code, start, end, limit, fetch_size=HISTORY_FETCH_SIZE
+    ):
+        yield rows
+
+async def copy_rates_out(
+    codes: list[str] | None,
+    start: date | None,
+    end: date | None,
+    as_json: bool = False,
+    header: bool = True,
+) -> AsyncIterator[bytes]:
+    """Курсы всех или выбранных валют за период текстом из COPY TO STDOUT.
+
+    Строки (date, currency_code, name, rate, nominal) по дате, затем коду
+    валюты, в CSV или NDJSON (объект на строку); пустой фильтр - без
+    ограничения. Текст формирует сам Postgres, куски вывода отдаются как
+    есть, не по границам строк. Данные идут через очередь на
+    EXPORT_COPY_QUEUE кусков: пока их не забрали, COPY стоит.
+    """
+    if as_json:
+        query = f"SELECT row_to_json(r)::text FROM ({_EXPORT_SELECT}) r"
+        options = _JSON_COPY_OPTIONS
+    else:
+        query = _EXPORT_SELECT
+        options = {'format': 'csv', 'header': header}
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=EXPORT_COPY_QUEUE)
+    async with read_engine.connect() as conn:
+        raw_connection = (await conn.get_raw_connection()).driver_connection
+
+        async def copy():
+            # None в очереди - конец данных, в том числе при ошибке
+            try:
+                await raw_connection.copy_from_query(
+                    query, codes or None, start, end, output=queue.put, **options
+                )
+            except Exception:
+                await queue.put(None)
+                raise
+            await queue.put(None)
+
+        task = asyncio.create_task(copy())
+        try:
+            while (chunk := await queue.get()) is not None:
+                yield bytes(chunk)
+            await task
+        finally:
+            if not task.done():
+                # Клиент ушёл посреди выгрузки: COPY прерван, соединение в пул не вернётся
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+                await conn.invalidate()
+
+async def get_rate_validators(target_date: date) -> tuple[str, datetime] | None:
+    """ETag и Last-Modified набора курсов на дату без чтения самих курсов.
+
+    Берутся из кэша, а если набора там нет - из rate_snapshot с учётом
+    rate_effective_date. None - валидаторов нет, нужен полный ответ.
+    """
+    rate_set = rate_cache.get(target_date)
+    if rate_set is not None:
+        if rate_set.etag is None:
+            return None
+        return rate_set.etag, rate_set.last_modified
+
+    row = await _queries_for(target_date, False).fetchrow(_SELECT_VALIDATORS, target_date)
+    return (row['etag'], row['updated_at']) if row else None
+
+async def _notify_changed(session: AsyncSession, dates: Iterable[date]) -> None:
+    # NOTIFY в той же транзакции: слушатели получат его только после коммита
+    dates = sorted(dates)
+    for start in range(0, len(dates), NOTIFY_MAX_DATES):
+        payload = ",".join(changed.isoformat() for changed in dates[start:start + NOTIFY_MAX_DATES])
+        await session.execute(_NOTIFY, {'channel': RATES_CHANNEL, 'payload': payload})
+
+async def save_effective_dates(session: AsyncSession, mapping: dict) -> int:
+    """Сохраняет соответствие запрошенная дата -> дата курсов ЦБ (None - курсов нет)."""
+    if not mapping:
+        return 0
+
+    stmt = insert(EffectiveDate).values([
+        {'requested_date': requested_date, 'effective_date': effective_date}
+        for requested_date, effective_date in mapping.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['requested_date'],
+        set_={
+            'effective_date': stmt.excluded.effective_date,
+            'checked_at': func.now(),
+        }
+    )
+    try:
+        await session.execute(stmt)
+        await _notify_changed(session, mapping)
+        await session.commit()
+    except Exception as e:
+        logger.error(f"Error saving effective dates: {e}", exc_info=True)
+        await session.rollback()
+        return 0
+
+    for requested_date in mapping:
+        rate_cache.invalidate(requested_date)
+    mark_written(mapping)
+    return len(mapping)
+
+def _dedupe_rates(rates: list[RateRecord]) -> list[RateRecord]:
+    # Одна команда ON CONFLICT не может обновить строку дважды, поэтому
+    # оставляем последнее значение для каждой пары (дата, валюта)
+    unique = {(rate.date, rate.currency_code): rate for rate in rates}
+    return list(unique.values())
+
+def _invalidate_dates(rates: list[RateRecord]) -> None:
+    # Закоммиченные даты больше не должны отдаваться из кэша
+    saved_dates = {rate.date for rate in rates}
+    for saved_date in saved_dates:
+        rate_cache.invalidate(saved_date)
+    mark_written(saved_dates)
+
+async def save_rates(session: AsyncSession, rates: list[RateRecord]):
     if not rates:
         logger.warning("No rates to save")
         return 0
 
-    count = 0
+    rates = _dedupe_rates(rates)
     try:
-        for rate in rates:
-            logger.debug(f"Saving rate: {rate}")  # Логируем каждый курс перед сохранением
-            stmt = insert(CurrencyRate).values(
-                date=rate['date'],
-                currency_code=rate['currency_code'],
-                name=rate['name'],
-                rate=Decimal(str(rate['rate'])),
-                nominal=rate['nominal']
-            ).on_conflict_do_update(
-                index_elements=['date', 'currency_code'],
-                set_={
-                    'name': rate['name'],
-                    'rate': Decimal(str(rate['rate'])),
-                    'nominal': rate['nominal']
-                }
-            )
-            await session.execute(stmt)
-            count += 1
+        await ensure_rate_partitions(rate.date for rate in rates)
+        await session.execute(_UPSERT_RATES, {
+            'dates': [rate.date for rate in rates],
+            'codes': [rate.currency_code for rate in rates],
+            'names': [rate.name for rate in rates],
+            'rates': [rate.rate for rate in rates],
+            'nominals': [rate.nominal for rate in rates],
+        })
+        changed = await session.scalars(_REFRESH_SNAPSHOTS, {'dates': list({rate.date for rate in rates})})
+        changed_dates = changed.all()
+        # Статистику и другие процессы трогаем, только если курсы изменились
+        await refresh_rollups(session, changed_dates)
+        await _notify_changed(session, changed_dates)
+        count = len(rates)
         await session.commit()
         logger.info(f"Upserted {count} currency rates")
+
+        _invalidate_dates(rates)
     except Exception as e:
         logger.error(f"Error saving rates: {e}", exc_info=True)
         await session.rollback()
         return 0
 
     return count
+
+async def copy_rates(session: AsyncSession, rates: Iterable[RateRecord]) -> int:
+    """Загрузка больших объёмов (бэкфилл) через COPY во временную таблицу.
+
+    rates может быть любым итерируемым объектом, в том числе генератором.
+    Строки копируются в staging-таблицу, затем переносятся в currency_rate
+    одним INSERT ... SELECT ... ON CONFLICT. Статистику (app.rollups) после
+    загрузки нужно перестроить через rebuild_rollups.
+    """
+    loaded_dates = set()
+
+    def records():
+        # RateRecord - уже кортеж в порядке колонок staging-таблицы
+        for rate in rates:
+            loaded_dates.add(rate.date)
+            yield rate
+
+    try:
+        # Первый execute через сессию открывает транзакцию, иначе
+        # ON COMMIT DROP удалит таблицу сразу после создания
+        await session.execute(text(_CREATE_STAGE_SQL))
+
+        connection = await session.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+            _STAGE_TABLE,
+            records=records(),
+            columns=_STAGE_COLUMNS,
+        )
+
+        # Годы известны только после прохода по rates
+        await ensure_rate_partitions(loaded_dates)
+        result = await session.execute(text(_MERGE_STAGE_SQL))
+        count = result.rowcount
+        changed = await session.scalars(_REFRESH_SNAPSHOTS, {'dates': list(loaded_dates)})
+        await _notify_changed(session, changed.all())
+        await session.commit()
+        logger.info(f"Copied {count} currency rates for {len(loaded_dates)} dates")
+
+        for loaded_date in loaded_dates:
+            rate_cache.invalidate(loaded_date)
+        mark_written(loaded_dates)
+    except Exception as e:
+        logger.error(f"Error copying rates: {e}", exc_info=True)
+        await session.rollback()
+        return 0
+
+    return count
@@ -1,20 +1,119 @@
 import os
+import time
+from contextlib import asynccontextmanager
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from dotenv import load_dotenv
 import logging
 
+from app.metrics import (
+    advisory_lock_wait,
+    db_pool_checkout_wait,
+    db_statement_duration,
+    db_statement_errors,
+    registry,
+    statement_operation,
+)
+
 logger = logging.getLogger(__name__)
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Чтения API можно отправить на реплику; по умолчанию - та же база, но
+# отдельный пул, чтобы поток чтений не отнимал соединения у записи
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or DATABASE_URL
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Пул, который меряет ожидание свободного соединения. Класс, а не
+    событие: checkout-события срабатывают уже после ожидания. Метка пула -
+    pool_logging_name движка."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started, self.logging_name)
+
+
+def _statement_started(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = time.perf_counter()
+
+
+def _statement_finished(conn, cursor, statement, parameters, context, executemany):
+    db_statement_duration.observe(
+        time.perf_counter() - context._metrics_started, statement_operation(statement)
+    )
+
+
+def _statement_failed(exception_context):
+    if exception_context.statement is not None:
+        db_statement_errors.inc(statement_operation(exception_context.statement))
+
+
+def _create_engine(url: str, name: str, pool_size: int, max_overflow: int, **kwargs):
+    created = create_async_engine(
+        url,
+        future=True,
+        echo=False,
+        poolclass=TimedQueuePool,
+        pool_logging_name=name,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        **kwargs,
+    )
+    event.listen(created.sync_engine, "before_cursor_execute", _statement_started)
+    event.listen(created.sync_engine, "after_cursor_execute", _statement_finished)
+    event.listen(created.sync_engine, "handle_error", _statement_failed)
+    return created
 
-engine = create_async_engine(
-    DATABASE_URL,
-    future=True,
-    echo=False,
-    pool_timeout=30,
-    pool_recycle=3600
+
+engine = _create_engine(DATABASE_URL, "write", DB_POOL_SIZE, DB_MAX_OVERFLOW)
+# Только чтение: случайная запись через этот движок упадёт и на основной базе
+read_engine = _create_engine(
+    DATABASE_READ_URL, "read", DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW,
+    connect_args={"server_settings": {"default_transaction_read_only": "on"}},
+)
+ENGINES = {"write": engine, "read": read_engine}
+
+
+def pool_stats() -> dict:
+    stats = {
+        name: {
+            'size': created.pool.size(),
+            'checked_out': created.pool.checkedout(),
+            'overflow': max(0, created.pool.overflow()),
+        }
+        for name, created in ENGINES.items()
+    }
+    stats['read']['replica'] = DATABASE_READ_URL != DATABASE_URL
+    return stats
+
+
+registry.callback(
+    "db_pool_size", "Configured DB pool size",
+    lambda: {(name,): created.pool.size() for name, created in ENGINES.items()}, ("pool",),
+)
+registry.callback(
+    "db_pool_checked_out", "DB connections currently in use",
+    lambda: {(name,): created.pool.checkedout() for name, created in ENGINES.items()}, ("pool",),
+)
+registry.callback(
+    "db_pool_overflow", "DB connections opened above pool size",
+    lambda: {(name,): max(0, created.pool.overflow()) for name, created in ENGINES.items()}, ("pool",),
 )
 
 AsyncSessionLocal = sessionmaker(
@@ -22,11 +121,16 @@ AsyncSessionLocal = sessionmaker(
     class_=AsyncSession,
     expire_on_commit=False
 )
+ReadSessionLocal = sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
 
 Base = declarative_base()
 
-async def get_db():
-    async with AsyncSessionLocal() as session:
+async def get_read_db():
+    async with ReadSessionLocal() as session:
         try:
             yield session
         finally:
@@ -42,5 +146,48 @@ async def init_db():
         raise
 
 async def shutdown_db():
-    await engine.dispose()
-    logger.info("Database engine disposed")
+    for created in ENGINES.values():
+        await created.dispose()
+    logger.info("Database engines disposed")
+
+@asynccontextmanager
+async def try_advisory_lock(key: int):
+    """Неблокирующая advisory-блокировка Postgres на время блока.
+
+    Отдаёт True, если блокировку удалось взять. Блокировка транзакционная:
+    она снимается вместе с транзакцией, даже если соединение оборвалось.
+    """
+    async with engine.connect() as conn:
+        async with conn.begin():
+            acquired = await conn.scalar(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": key}
+            )
+            yield acquired
+
+# SQLSTATE lock_not_available: истёк lock_timeout
+_LOCK_NOT_AVAILABLE = '55P03'
+
+@asynccontextmanager
+async def advisory_lock(key: int, timeout: float):
+    """Блокирующая advisory-блокировка Postgres на время блока.
+
+    Ждёт не дольше timeout секунд и отдаёт True, если блокировку удалось
+    взять, False - если время вышло. Как и в try_advisory_lock, блокировка
+    транзакционная и держится отдельным соединением.
+    """
+    async with engine.connect() as conn:
+        async with conn.begin():
+            await conn.execute(
+                text("SELECT set_config('lock_timeout', :timeout, true)"),
+                {"timeout": f"{max(1, int(timeout * 1000))}ms"},
+            )
+            started = time.perf_counter()
+            try:
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": key})
+                acquired = True
+            except DBAPIError as e:
+                if getattr(e.orig, 'sqlstate', None) != _LOCK_NOT_AVAILABLE:
+                    raise
+                acquired = False
+            advisory_lock_wait.observe(time.perf_counter() - started, str(acquired).lower())
+            yield acquired
@@ -0,0 +1,247 @@
+"""Выгрузка истории курсов целиком: CSV, NDJSON, Apache Arrow.
+
+Текст выгрузки формирует Postgres (COPY TO STDOUT, crud.copy_rates_out):
+CSV и NDJSON уходят клиенту кусками как есть, для Arrow CSV разбирается
+pyarrow в потоке. Построчной работы в цикле событий нет, поэтому обычные
+запросы выгрузку почти не замечают, а память не зависит от её размера.
+Одновременных выгрузок не больше EXPORT_MAX_CONCURRENT, остальные ждут
+очереди, не занимая соединений.
+"""
+import asyncio
+import logging
+import os
+import time
+import zlib
+from datetime import date
+from typing import AsyncIterator, NamedTuple
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from app.crud import copy_rates_out
+from app.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько байт CSV собирать в один record batch Arrow (~16 тыс. строк на 1 МБ)
+EXPORT_ARROW_BATCH_BYTES = int(os.getenv("EXPORT_ARROW_BATCH_BYTES", str(1 << 20)))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "2"))
+# 6 - обычный компромисс zlib; 9, как у GZipMiddleware, заметно дороже
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+
+export_bytes = registry.counter("export_bytes_total", "Uncompressed bytes streamed by /exports/rates", ("format",))
+export_duration = registry.histogram(
+    "export_duration_seconds", "Duration of /exports/rates streams", ("format",),
+    (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+class ExportFormat(NamedTuple):
+    media_type: str
+    extension: str
+
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat("text/csv; charset=utf-8", "csv"),
+    'ndjson': ExportFormat("application/x-ndjson", "ndjson"),
+    'arrow': ExportFormat("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+_MEDIA_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+}
+
+# Конец IPC-потока: continuation-маркер и сообщение нулевой длины
+_ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def available_formats() -> list[str]:
+    return list(EXPORT_FORMATS)
+
+
+def _media_ranges(header: str) -> list[tuple[str, float]]:
+    ranges = []
+    for item in header.split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type and quality > 0:
+            ranges.append((media_type.lower(), quality))
+    # sorted устойчива: при равном q важен порядок в заголовке
+    return sorted(ranges, key=lambda item: -item[1])
+
+
+def negotiate_format(accept: str | None) -> str | None:
+    """Формат выгрузки по заголовку Accept; None - ни один не подходит.
+
+    Без заголовка и для */* - CSV.
+    """
+    if not accept:
+        return 'csv'
+    formats = available_formats()
+    for media_type, _ in _media_ranges(accept):
+        if media_type in ('*/*', 'text/*'):
+            return 'csv'
+        name = _MEDIA_TYPES.get(media_type)
+        if name in formats:
+            return name
+    return None
+
+
+def accepts_gzip(accept_encoding: str | None) -> bool:
+    return any(coding == 'gzip' for coding, _ in _media_ranges(accept_encoding or ""))
+
+
+def _arrow_schema():
+    return pa.schema([
+        ('date', pa.date32()),
+        ('currency_code', pa.string()),
+        ('name', pa.string()),
+        ('rate', pa.decimal128(12, 6)),
+        ('nominal', pa.int32()),
+    ])
+
+
+def _record_boundary(data: bytes) -> int:
+    """Длина полных CSV-записей в начале data.
+
+    Перевод строки внутри значения в кавычках записи не заканчивает: до
+    конца записи кавычек чётное число ("" внутри значения - тоже пара).
+    """
+    end = data.rfind(b"\n")
+    while end >= 0 and data.count(b'"', 0, end) % 2:
+        end = data.rfind(b"\n", 0, end)
+    return end + 1
+
+
+def _arrow_batches(schema, data: bytes) -> bytes:
+    # Пустое значение без кавычек - NULL, как его пишет COPY ... CSV
+    table = pa_csv.read_csv(
+        pa.BufferReader(data),
+        read_options=pa_csv.ReadOptions(column_names=schema.names, use_threads=False),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=schema, strings_can_be_null=True, quoted_strings_can_be_null=False
+        ),
+    )
+    return b"".join(batch.serialize().to_pybytes() for batch in table.to_batches())
+
+
+async def _arrow_chunks(codes: list[str] | None, start: date | None, end: date | None,
+                        batch_bytes: int) -> AsyncIterator[bytes]:
+    """IPC streaming format: схема, record batch'и, EOS.
+
+    Сообщения сериализуются по отдельности, без RecordBatchStreamWriter:
+    тому нужен файловый поток, а здесь каждая пачка сразу уходит клиенту.
+    Разбор CSV в pyarrow отпускает GIL, поэтому идёт в потоке.
+    """
+    schema = _arrow_schema()
+    yield schema.serialize().to_pybytes()
+
+    pending = []
+    pending_size = 0
+    async for chunk in copy_rates_out(codes, start, end, header=False):
+        pending.append(chunk)
+        pending_size += len(chunk)
+        if pending_size < batch_bytes:
+            continue
+        data = b"".join(pending)
+        cut = _record_boundary(data)
+        if cut:
+            yield await asyncio.to_thread(_arrow_batches, schema, data[:cut])
+        pending = [data[cut:]]
+        pending_size = len(pending[0])
+
+    if pending_size:
+        yield await asyncio.to_thread(_arrow_batches, schema, b"".join(pending))
+    yield _ARROW_EOS
+
+
+class RateExporter:
+    """Потоковая выгрузка курсов с ограничением числа одновременных выгрузок."""
+
+    def __init__(self, max_concurrent: int = EXPORT_MAX_CONCURRENT,
+                 arrow_batch_bytes: int = EXPORT_ARROW_BATCH_BYTES, gzip_level: int = EXPORT_GZIP_LEVEL):
+        self.arrow_batch_bytes = arrow_batch_bytes
+        self.gzip_level = gzip_level
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+
+    def _chunks(self, export_format: str, codes, start, end) -> AsyncIterator[bytes]:
+        if export_format == 'arrow':
+            return _arrow_chunks(codes, start, end, self.arrow_batch_bytes)
+        return copy_rates_out(codes, start, end, as_json=export_format == 'ndjson')
+
+    async def stream(
+        self,
+        export_format: str,
+        codes: list[str] | None,
+        start: date | None,
+        end: date | None,
+        compress: bool = False,
+    ) -> AsyncIterator[bytes]:
+        # wbits 31 - zlib пишет gzip-заголовок и CRC
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31) if compress else None
+
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        started = time.perf_counter()
+        size = 0
+        try:
+            async for chunk in self._chunks(export_format, codes, start, end):
+                size += len(chunk)
+                if compressor is not None:
+                    # zlib отпускает GIL, так что сжатие в потоке не мешает циклу событий
+                    chunk = await asyncio.to_thread(compressor.compress, chunk)
+                if chunk:
+                    yield chunk
+            if compressor is not None:
+                yield compressor.flush()
+            self.completed += 1
+            logger.info(
+                f"Exported {size / 1e6:.1f} MB as {export_format} in {time.perf_counter() - started:.2f}s"
+            )
+        except BaseException as e:
+            # В том числе отключение клиента посреди выгрузки
+            self.failed += 1
+            logger.warning(f"Export as {export_format} aborted after {size} bytes: {e!r}")
+            raise
+        finally:
+            self.active -= 1
+            self._slots.release()
+            self.bytes += size
+            export_bytes.inc(export_format, amount=size)
+            export_duration.observe(time.perf_counter() - started, export_format)
+
+    def stats(self) -> dict:
+        return {
+            'max_concurrent': self.max_concurrent,
+            'active': self.active,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+            'bytes': self.bytes,
+            'formats': available_formats(),
+        }
+
+
+rate_exporter = RateExporter()
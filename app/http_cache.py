@@ -0,0 +1,69 @@
+import os
+from datetime import date, datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+# Курсы прошедших дат ЦБ не меняет, их можно кэшировать сколько угодно
+HTTP_MAX_AGE_PAST = int(os.getenv("HTTP_MAX_AGE_PAST", "31536000"))
+HTTP_MAX_AGE_TODAY = int(os.getenv("HTTP_MAX_AGE_TODAY", "60"))
+
+
+def cache_headers(target_date: date, etag: str | None, last_modified: datetime | None, variant: str = "") -> dict:
+    """Заголовки кэширования ответа с курсами на запрошенную дату.
+
+    variant отличает представления одного набора курсов (например,
+    ответ по одной валюте) - их ETag не должны совпадать. ETag слабый:
+    GZipMiddleware отдаёт тот же ответ и сжатым, и нет, а сильный ETag
+    обязан различаться для разных байтов.
+    """
+    if target_date < date.today():
+        headers = {"Cache-Control": f"public, max-age={HTTP_MAX_AGE_PAST}, immutable"}
+    else:
+        headers = {"Cache-Control": f"public, max-age={HTTP_MAX_AGE_TODAY}"}
+
+    if etag is not None:
+        headers["ETag"] = f'W/"{etag}{"-" + variant if variant else ""}"'
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    # Для If-None-Match сравнение слабое: префикс W/ не учитывается
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag.removeprefix("W/") in candidates
+
+
+def is_not_modified(request: Request, headers: dict) -> bool:
+    """Можно ли ответить 304 на запрос с такими валидаторами.
+
+    If-None-Match, если он есть, главнее If-Modified-Since (RFC 9110).
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return "ETag" in headers and _etag_matches(if_none_match, headers["ETag"])
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or "Last-Modified" not in headers:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    # HTTP-дата с точностью до секунды
+    return parsedate_to_datetime(headers["Last-Modified"]) <= since
+
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def not_modified(headers: dict) -> Response:
+    # GZipMiddleware добавляет Vary только к ответам с телом, а 304 должен
+    # нести те же Vary, что и полный ответ
+    return Response(status_code=304, headers={**headers, "Vary": "Accept-Encoding"})
@@ -0,0 +1,69 @@
+from datetime import date
+import logging
+
+from app.cbr_client import CBRUnavailableError
+from app.coordination import RATES_LOCK_TIMEOUT, rates_lock_key
+from app.crud import get_cached_rates, save_effective_dates, save_rates
+from app.database import AsyncSessionLocal, advisory_lock
+from app.metrics import rate_loads
+from app.singleflight import SingleFlight
+from app.utils import fetch_cbr_rates
+
+logger = logging.getLogger(__name__)
+
+rates_flight = SingleFlight()
+
+
+async def _load_once(target_date: date) -> date | None:
+    # Блокировка на дату общая для всех процессов: в ЦБ идёт только тот,
+    # кто её взял, остальные дожидаются и читают сохранённое им
+    async with advisory_lock(rates_lock_key(target_date), RATES_LOCK_TIMEOUT) as acquired:
+        if not acquired:
+            logger.warning(f"Timed out waiting for another process to load {target_date}, fetching anyway")
+
+        # С основной базы: запись другого процесса могла не дойти до реплики
+        rate_set = await get_cached_rates(target_date, primary=True)
+        if rate_set is not None:
+            rate_loads.inc("found")
+            logger.info(f"Rates for {target_date} already loaded by another process")
+            return rate_set.date if rate_set.rates else None
+
+        rate_loads.inc("fetched")
+        return await _fetch_and_save(target_date)
+
+
+async def _fetch_and_save(target_date: date) -> date | None:
+    new_rates = await fetch_cbr_rates(target_date)
+    if new_rates is None:
+        # 4xx (в том числе 429) или битый XML - это не "курсов нет": такое
+        # соответствие разошлось бы всем воркерам и на RATE_NEGATIVE_TTL
+        # закрыло бы дату
+        raise CBRUnavailableError(f"No valid CBR response for {target_date}")
+    logger.info(f"Received {len(new_rates)} rates from CBR for {target_date}")
+
+    # Дата в ответе ЦБ может отличаться от запрошенной
+    cbr_date = new_rates[0].date if new_rates else None
+
+    # Своя сессия: задача переживает запрос, который её запустил
+    async with AsyncSessionLocal() as session:
+        if new_rates:
+            saved_count = await save_rates(session, new_rates)
+            logger.info(f"Upserted {saved_count} currency rates for {cbr_date}")
+
+        # Для будущих дат ЦБ до публикации отдаёт последние курсы, такое
+        # соответствие устареет - запоминаем только наступившие даты
+        if cbr_date != target_date and target_date <= date.today():
+            await save_effective_dates(session, {target_date: cbr_date})
+            logger.info(f"Effective date for {target_date} is {cbr_date}")
+
+    return cbr_date
+
+
+async def load_cbr_rates(target_date: date) -> date | None:
+    """Загружает курсы ЦБ на дату и сохраняет их в базе.
+
+    Конкурентные вызовы на одну дату - в этом процессе и во всех остальных,
+    работающих с той же базой, - выполняют один запрос к ЦБ и одну запись
+    в базу. Возвращает дату из ответа ЦБ или None, если курсов нет.
+    """
+    return await rates_flight.do(target_date, lambda: _load_once(target_date))
@@ -1,25 +1,53 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from datetime import date
+from datetime import date, timedelta
+from typing import Literal, Optional
+import json
 import logging
+import math
+import re
 import traceback
 
-from app.database import init_db, shutdown_db, get_db
-from app.crud import get_rates_by_date, save_rates
-from app.schemas import CurrencyRateSchema
-from app.utils import fetch_cbr_rates
-from app.models import CurrencyRate
+import numpy as np
+
+from app.database import init_db, pool_stats, shutdown_db, get_read_db
+from app.crud import get_cached_rates, get_rate_validators, get_rates_for_pairs, stream_rate_history
+from app.cache import RateSet, rate_cache
+from app.cbr_client import CBRUnavailableError, cbr_client
+from app.conversion import conversion_engine
+from app.coordination import RATES_LISTEN_ENABLED, rates_listener
+from app.exports import EXPORT_FORMATS, accepts_gzip, available_formats, negotiate_format, rate_exporter
+from app.http_cache import cache_headers, has_conditional_headers, is_not_modified, not_modified
+from app.loader import load_cbr_rates, rates_flight
+from app.metrics import MetricsMiddleware, registry
+from app.queries import primary_queries, read_queries
+from app.rollups import VOLATILITY_WINDOW, get_rate_stats
+from app.scheduler import PREFETCH_ENABLED, prefetch_scheduler
+from app.schemas import BatchRateResultSchema, ConvertBatchRequest, CurrencyRateSchema, RateLookupSchema
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+HISTORY_DEFAULT_DAYS = 365
+HISTORY_MAX_LIMIT = 10000
+BATCH_MAX_ITEMS = 50000
+CONVERT_MAX_ITEMS = 1000000
+# Знаков после запятой в результатах пересчёта
+CONVERT_PRECISION = 6
+CURRENCY_CODE_RE = re.compile(r'[A-Z]{3}')
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     try:
         await init_db()
+        await cbr_client.start()
+        if RATES_LISTEN_ENABLED:
+            rates_listener.start()
+        if PREFETCH_ENABLED:
+            prefetch_scheduler.start()
         logger.info("Service started successfully")
     except Exception as e:
         logger.error(f"Startup failed: {str(e)}")
@@ -28,6 +56,9 @@ async def lifespan(app: FastAPI):
     yield
 
     try:
+        await prefetch_scheduler.stop()
+        await rates_listener.stop()
+        await cbr_client.close()
         await shutdown_db()
         logger.info("Service stopped gracefully")
     except Exception as e:
@@ -40,6 +71,10 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+# Последним, то есть снаружи: в задержку входит и сжатие ответа
+app.add_middleware(MetricsMiddleware)
+
 
 @app.exception_handler(Exception)
 async def debug_exception_handler(request, exc):
@@ -49,50 +84,93 @@ async def debug_exception_handler(request, exc):
         content={"detail": "Internal Server Error"}
     )
 
-@app.get("/exchange-rates", response_model=list[CurrencyRateSchema])
-async def get_exchange_rates(db: AsyncSession = Depends(get_db)):
-    today = date.today()
-    logger.info(f"Request for exchange rates on {today}")
-
-    try:
-        # Сначала пытаемся получить курсы из базы по сегодняшней дате
-        existing_rates = await get_rates_by_date(db, today)
-        if existing_rates:
-            logger.info(f"Returning {len(existing_rates)} rates from database for date {today}")
-            return existing_rates
-
-        logger.info("No rates found in DB, fetching from CBR")
+async def _get_or_load_rates(target_date: date) -> RateSet:
+    """Набор курсов на дату из кэша/базы, на сегодня - с догрузкой из ЦБ.
 
-        new_rates = await fetch_cbr_rates(today)
-        logger.info(f"Received {len(new_rates)} rates from CBR")
-
-        if not new_rates:
-            logger.warning("No rates received from CBR")
+    Соединение берётся только на время запросов к базе: ожидание ЦБ
+    пул не занимает.
+    """
+    rate_set = await get_cached_rates(target_date)
+    if rate_set is not None:
+        if not rate_set.rates:
             raise HTTPException(
                 status_code=404,
                 detail="Currency rates not available"
             )
+        return rate_set
 
-        # Логируем дату из данных ЦБР
-        first_date = new_rates[0]['date']
-        logger.info(f"Date in fetched rates: {first_date}")
+    if target_date != date.today():
+        raise HTTPException(
+            status_code=404,
+            detail="Currency rates not available"
+        )
 
-        # Сохраняем курсы в базе
-        saved_count = await save_rates(db, new_rates)
-        logger.info(f"Upserted {saved_count} currency rates")
+    logger.info("No rates found in DB, fetching from CBR")
 
-        # Используем дату из данных для чтения из базы
-        db_rates = await get_rates_by_date(db, first_date)
-        logger.info(f"Rates fetched after save: {len(db_rates)} for date {first_date}")
+    try:
+        first_date = await load_cbr_rates(target_date)
+    except CBRUnavailableError as e:
+        logger.warning(f"CBR unavailable: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="CBR is unavailable, try again later"
+        )
+
+    if first_date is None:
+        logger.warning("No rates received from CBR")
+        raise HTTPException(
+            status_code=404,
+            detail="Currency rates not available"
+        )
+
+    # Сегодняшняя дата теперь разрешается в дату из данных ЦБ. С основной
+    # базы: реплика могла ещё не получить только что записанное
+    rate_set = await get_cached_rates(target_date, primary=True)
+
+    if rate_set is None or not rate_set.rates:
+        logger.error("Saved rates not found in database")
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to retrieve saved rates"
+        )
+
+    logger.info(f"Rates fetched after save: {len(rate_set.rates)} for date {first_date}")
+    return rate_set
+
+
+async def _not_modified(request: Request, target_date: date) -> Response | None:
+    """Ответ 304, если у клиента актуальная версия курсов на дату.
+
+    Сверяется только ETag/Last-Modified набора, сами курсы не читаются.
+    """
+    if not has_conditional_headers(request):
+        return None
+
+    validators = await get_rate_validators(target_date)
+    if validators is None:
+        return None
+
+    headers = cache_headers(target_date, *validators)
+    return not_modified(headers) if is_not_modified(request, headers) else None
 
-        if not db_rates:
-            logger.error("Saved rates not found in database")
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to retrieve saved rates"
-            )
 
-        return db_rates
+@app.get("/exchange-rates", response_model=list[CurrencyRateSchema])
+async def get_exchange_rates(request: Request):
+    today = date.today()
+    logger.debug(f"Request for exchange rates on {today}")
+
+    try:
+        cached_response = await _not_modified(request, today)
+        if cached_response is not None:
+            return cached_response
+
+        rate_set = await _get_or_load_rates(today)
+        # Готовые байты из RateSet: response_model только описывает схему
+        return Response(
+            rate_set.json(),
+            media_type="application/json",
+            headers=cache_headers(today, rate_set.etag, rate_set.last_modified),
+        )
 
     except HTTPException:
         raise
@@ -106,25 +184,30 @@ async def get_exchange_rates(db: AsyncSession = Depends(get_db)):
 
 @app.get("/exchange-rates/{currency_code}", response_model=CurrencyRateSchema)
 async def get_exchange_rate(
+    request: Request,
     currency_code: str,
-    date: date = Query(default=date.today()),
-    db: AsyncSession = Depends(get_db)
+    rate_date: Optional[date] = Query(default=None, alias="date"),
 ):
     currency_code = currency_code.upper()
-    logger.info(f"Request for rate of {currency_code} on {date}")
+    # Код попадает в ETag, а заголовки - только latin-1
+    if not CURRENCY_CODE_RE.fullmatch(currency_code):
+        raise HTTPException(status_code=404, detail="Currency rate not found")
+    # Значение по умолчанию вычисляем на каждый запрос, а не при импорте модуля
+    target_date = rate_date or date.today()
+    logger.debug(f"Request for rate of {currency_code} on {target_date}")
 
     try:
-        result = await db.execute(
-            select(CurrencyRate).where(
-                CurrencyRate.currency_code == currency_code,
-                CurrencyRate.date == date
-            )
-        )
-        rate = result.scalars().first()
-        if not rate:
+        # 304 - только для валюты, которая есть в наборе: набор нужен и
+        # для условного запроса, но он почти всегда уже в кэше
+        rate_set = await get_cached_rates(target_date)
+        body = rate_set.json_for(currency_code) if rate_set else None
+        if body is None:
             raise HTTPException(status_code=404, detail="Currency rate not found")
 
-        return rate
+        headers = cache_headers(target_date, rate_set.etag, rate_set.last_modified, variant=currency_code)
+        if has_conditional_headers(request) and is_not_modified(request, headers):
+            return not_modified(headers)
+        return Response(body, media_type="application/json", headers=headers)
 
     except HTTPException:
         raise
@@ -132,6 +215,340 @@ async def get_exchange_rate(
         logger.exception("Error fetching currency rate")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/exchange-rates/batch", response_model=list[BatchRateResultSchema])
+async def get_exchange_rates_batch(
+    items: list[RateLookupSchema],
+):
+    """Курсы для списка пар (валюта, дата) одним запросом.
+
+    Ответ идёт в порядке запроса; ненайденная пара помечается found=false
+    и не роняет весь пакет. Курсы у ЦБ не догружаются.
+    """
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items, at most {BATCH_MAX_ITEMS} per batch"
+        )
+
+    logger.debug(f"Batch request for {len(items)} rates")
+
+    try:
+        found = await get_rates_for_pairs(((item.currency_code, item.date) for item in items))
+    except Exception as e:
+        logger.exception("Error resolving batch rates")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    # Ответ собирается в json.dumps напрямую: на десятках тысяч элементов
+    # jsonable_encoder и валидация response_model дольше самого запроса к базе
+    encoded = {
+        pair: {
+            'date': rate['date'].isoformat(),
+            'currency_code': rate['currency_code'],
+            'name': rate['name'],
+            'rate': float(rate['rate']),
+            'nominal': rate['nominal'],
+        }
+        for pair, rate in found.items()
+    }
+    results = []
+    for item in items:
+        rate = encoded.get((item.currency_code, item.date))
+        results.append({
+            'currency_code': item.currency_code,
+            'date': item.date.isoformat(),
+            'found': rate is not None,
+            'rate': rate,
+        })
+    return Response(
+        json.dumps(results, ensure_ascii=False, separators=(',', ':')),
+        media_type="application/json",
+    )
+
+
+def _history_row(row) -> str:
+    rate_date, rate, nominal = row
+    return f'{{"date":"{rate_date.isoformat()}","rate":{float(rate)!r},"nominal":{nominal}}}'
+
+
+async def _history_json(currency_code: str, start: date, end: date, limit: int):
+    # Берём на строку больше страницы: по ней видно, есть ли продолжение
+    # Код из пути - произвольная строка, в JSON только через json.dumps
+    yield f'{{"currency_code":{json.dumps(currency_code)},"rates":['
+    count = 0
+    last_date = None
+    has_more = False
+    async for rows in stream_rate_history(currency_code, start, end, limit + 1):
+        chunk = []
+        for row in rows:
+            if count == limit:
+                has_more = True
+                break
+            chunk.append(("," if count else "") + _history_row(row))
+            count += 1
+            last_date = row['date']
+        yield "".join(chunk)
+
+    next_after = f'"{last_date.isoformat()}"' if has_more else "null"
+    yield f'],"next_after":{next_after}}}'
+
+
+async def _history_ndjson(currency_code: str, start: date, end: date, limit: int):
+    async for rows in stream_rate_history(currency_code, start, end, limit):
+        yield "".join(_history_row(row) + "\n" for row in rows)
+
+
+@app.get("/exchange-rates/{currency_code}/history")
+async def get_exchange_rate_history(
+    currency_code: str,
+    date_from: Optional[date] = Query(default=None, alias="from"),
+    date_to: Optional[date] = Query(default=None, alias="to"),
+    after: Optional[date] = Query(default=None, description="дата последней строки предыдущей страницы"),
+    limit: int = Query(default=1000, ge=1, le=HISTORY_MAX_LIMIT),
+    format: Literal["json", "ndjson"] = "json",
+):
+    """Курс валюты за период по возрастанию даты, постранично.
+
+    Следующая страница запрашивается с after = next_after из ответа;
+    пустой next_after - данных больше нет. В ndjson признака конца нет:
+    after - дата последней строки, а страница короче limit строк -
+    последняя (при ровно limit строках следующая может оказаться пустой).
+    """
+    currency_code = currency_code.upper()
+    end = date_to or date.today()
+    start = date_from or end - timedelta(days=HISTORY_DEFAULT_DAYS)
+    if after is not None:
+        start = max(start, after + timedelta(days=1))
+    if date_from is not None and date_from > end:
+        raise HTTPException(status_code=400, detail="'from' must not be later than 'to'")
+
+    logger.debug(f"History request for {currency_code} from {start} to {end}")
+
+    if format == "ndjson":
+        return StreamingResponse(
+            _history_ndjson(currency_code, start, end, limit),
+            media_type="application/x-ndjson",
+        )
+    return StreamingResponse(
+        _history_json(currency_code, start, end, limit),
+        media_type="application/json",
+    )
+
+@app.get("/exchange-rates/{currency_code}/stats")
+async def get_exchange_rate_stats(
+    currency_code: str,
+    period: Literal["day", "month", "year"] = "month",
+    date_from: Optional[date] = Query(default=None, alias="from"),
+    date_to: Optional[date] = Query(default=None, alias="to"),
+    limit: int = Query(default=1000, ge=1, le=HISTORY_MAX_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Статистика курса за одну единицу валюты из предрасчитанных таблиц.
+
+    day - изменение к предыдущей дате курсов и скользящая волатильность
+    (стандартное отклонение дневных логарифмических доходностей за
+    volatility_window дат); month и year - открытие, закрытие, минимум,
+    максимум, среднее и волатильность за период. Для day по умолчанию -
+    последние HISTORY_DEFAULT_DAYS дней, для месяцев и лет - вся история.
+    """
+    currency_code = currency_code.upper()
+    end = date_to or date.today()
+    start = date_from
+    if start is None and period == "day":
+        start = end - timedelta(days=HISTORY_DEFAULT_DAYS)
+    if start is not None and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be later than 'to'")
+
+    items = await get_rate_stats(db, currency_code, period, start, end, limit)
+    return Response(
+        json.dumps({
+            "currency_code": currency_code,
+            "period": period,
+            "volatility_window": VOLATILITY_WINDOW if period == "day" else None,
+            "items": items,
+        }, ensure_ascii=False, separators=(',', ':')),
+        media_type="application/json",
+    )
+
+@app.get("/exports/rates")
+async def export_rates(
+    request: Request,
+    currency: Optional[list[str]] = Query(default=None, description="коды валют, можно через запятую"),
+    date_from: Optional[date] = Query(default=None, alias="from"),
+    date_to: Optional[date] = Query(default=None, alias="to"),
+    format: Optional[Literal["csv", "ndjson", "arrow"]] = None,
+):
+    """Выгрузка курсов всех или выбранных валют за период, потоком.
+
+    Формат - из format, иначе по заголовку Accept (text/csv,
+    application/x-ndjson, application/vnd.apache.arrow.stream), по умолчанию
+    CSV. Строки по возрастанию даты, затем кода валюты; без from и to -
+    вся история. При Accept-Encoding: gzip ответ сжимается на лету.
+    """
+    export_format = format or negotiate_format(request.headers.get("accept"))
+    if export_format not in available_formats():
+        raise HTTPException(
+            status_code=406,
+            detail=f"Supported export formats: {', '.join(available_formats())}"
+        )
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail="'from' must not be later than 'to'")
+
+    codes = sorted({
+        code.strip().upper()
+        for value in currency or []
+        for code in value.split(",")
+        if code.strip()
+    })
+    compress = accepts_gzip(request.headers.get("accept-encoding"))
+    export = EXPORT_FORMATS[export_format]
+    headers = {
+        "Content-Disposition": f'attachment; filename="rates.{export.extension}"',
+        "Vary": "Accept, Accept-Encoding",
+    }
+    if compress:
+        # С Content-Encoding GZipMiddleware ответ не трогает
+        headers["Content-Encoding"] = "gzip"
+
+    logger.debug(f"Export of {codes or 'all currencies'} from {date_from} to {date_to} as {export_format}")
+    return StreamingResponse(
+        rate_exporter.stream(export_format, codes, date_from, date_to, compress),
+        media_type=export.media_type,
+        headers=headers,
+    )
+
+@app.get("/convert")
+async def convert(
+    amount: float = 1.0,
+    from_currency: str = Query(alias="from"),
+    to_currency: str = Query(alias="to"),
+    rate_date: Optional[date] = Query(default=None, alias="date"),
+):
+    from_currency = from_currency.upper()
+    to_currency = to_currency.upper()
+    target_date = rate_date or date.today()
+    if not math.isfinite(amount):
+        raise HTTPException(status_code=400, detail="'amount' must be a finite number")
+
+    try:
+        vector = conversion_engine.vector(await _get_or_load_rates(target_date))
+        if from_currency not in vector.index or to_currency not in vector.index:
+            raise HTTPException(status_code=404, detail="Currency rate not found")
+
+        rate = float(vector.matrix[vector.index[from_currency], vector.index[to_currency]])
+        result = amount * rate
+        if not math.isfinite(result):
+            raise HTTPException(status_code=400, detail="Conversion result is out of range")
+        return {
+            "date": vector.date,
+            "from": from_currency,
+            "to": to_currency,
+            "amount": amount,
+            "rate": round(rate, CONVERT_PRECISION),
+            "result": round(result, CONVERT_PRECISION),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error converting currency")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@app.post("/convert")
+async def convert_batch(request: ConvertBatchRequest):
+    """Пересчёт массива сумм одним векторным проходом.
+
+    results идут в порядке amounts; null - неизвестная валюта в паре.
+    Суммы должны быть конечными; если результат не помещается в float,
+    весь запрос отклоняется с 400 и номерами таких сумм.
+    """
+    count = len(request.amounts)
+    if count > CONVERT_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many amounts, at most {CONVERT_MAX_ITEMS} per request"
+        )
+    for codes in (request.from_currency, request.to_currency):
+        if len(codes) not in (1, count):
+            raise HTTPException(
+                status_code=400,
+                detail="'from' and 'to' must be a single code or match 'amounts' in length"
+            )
+
+    amounts = np.asarray(request.amounts, dtype=np.float64)
+    if not np.isfinite(amounts).all():
+        raise HTTPException(status_code=400, detail="'amounts' must be finite numbers")
+
+    target_date = request.date or date.today()
+    try:
+        vector = conversion_engine.vector(await _get_or_load_rates(target_date))
+        with np.errstate(over='ignore'):
+            results = vector.convert(request.from_currency, request.to_currency, amounts)
+        # NaN - неизвестная валюта, бесконечность - переполнение
+        overflow = np.flatnonzero(np.isinf(results))
+        if overflow.size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Conversion result is out of range for amounts at {overflow[:10].tolist()}"
+            )
+        # np.round умножает на 10**precision и на огромных суммах сам
+        # переполняется: такие значения отдаём без округления
+        with np.errstate(over='ignore', invalid='ignore'):
+            rounded = np.round(results, CONVERT_PRECISION)
+        results = np.where(np.isfinite(rounded), rounded, results).tolist()
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("Error converting currency batch")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+    return Response(
+        json.dumps({
+            "date": vector.date.isoformat(),
+            "results": [None if math.isnan(value) else value for value in results],
+        }, separators=(',', ':')),
+        media_type="application/json",
+    )
+
+
+@app.get("/stats")
+async def get_stats():
+    return {
+        "rate_cache": rate_cache.stats(),
+        "cbr_inflight": rates_flight.inflight(),
+        "cbr": cbr_client.stats(),
+        "prefetch": prefetch_scheduler.stats(),
+        "coordination": rates_listener.stats(),
+        "conversion": conversion_engine.stats(),
+        "exports": rate_exporter.stats(),
+        "db": {
+            "pools": pool_stats(),
+            "queries": {"read": read_queries.stats(), "primary": primary_queries.stats()},
+        },
+    }
+
+registry.callback(
+    "rate_cache_lookups_total", "Rate cache lookups by result",
+    lambda: {("hit",): rate_cache.hits, ("miss",): rate_cache.misses}, ("result",), kind="counter",
+)
+registry.callback("rate_cache_evictions_total", "Rate cache evictions", lambda: rate_cache.evictions, kind="counter")
+registry.callback("rate_cache_size", "Dates held in the rate cache", lambda: rate_cache.stats()['size'])
+registry.callback("rate_cache_hit_ratio", "Rate cache hit ratio since start", lambda: rate_cache.stats()['hit_ratio'])
+registry.callback("cbr_inflight_loads", "Distinct dates being loaded from CBR", rates_flight.inflight)
+registry.callback(
+    "conversion_vector_builds_total", "Rate vectors built for conversion",
+    lambda: conversion_engine.builds, kind="counter",
+)
+registry.callback("exports_active", "Rate exports currently streaming", lambda: rate_exporter.active)
+registry.callback("exports_waiting", "Rate exports waiting for a free slot", lambda: rate_exporter.waiting)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/")
 async def root():
     return {"message": "Currency API is running"}
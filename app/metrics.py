@@ -0,0 +1,276 @@
+"""Метрики сервиса в текстовом формате Prometheus (GET /metrics).
+
+Без внешних зависимостей: сервис однопоточный (asyncio), поэтому
+счётчики обновляются без блокировок, а наблюдение в гистограмму - это
+bisect и два сложения.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import time
+from bisect import bisect_left
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Доля запросов под профилировщиком (0 - выключено) и порог, начиная с
+# которого профиль запроса попадает в лог
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "500"))
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "25"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Для набора меток: [счётчики по корзинам + одна на +Inf, сумма]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> list[str]:
+        lines = []
+        label_names = self.label_names + ("le",)
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(label_names, labels + (_format_value(bound),))} {cumulative}"
+                )
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class CallbackMetric(Metric):
+    """Значения снимаются функцией в момент отдачи /metrics: для того,
+    что и так уже считается (счётчики кэша, состояние пула)."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], float | dict[tuple, float]],
+        labels: tuple[str, ...] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def callback(self, name: str, documentation: str, callback, labels: tuple[str, ...] = (), kind: str = "gauge"):
+        return self.register(CallbackMetric(name, documentation, callback, labels, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.warning(f"Failed to collect metric {metric.name}: {e!r}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+db_statement_duration = registry.histogram(
+    "db_statement_duration_seconds", "SQL statement execution time", ("operation",), FAST_BUCKETS
+)
+db_statement_errors = registry.counter(
+    "db_statement_errors_total", "SQL statements that raised an error", ("operation",)
+)
+db_pool_checkout_wait = registry.histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection", ("pool",), FAST_BUCKETS
+)
+advisory_lock_wait = registry.histogram(
+    "db_advisory_lock_wait_seconds", "Time spent waiting for a blocking advisory lock", ("acquired",)
+)
+cbr_request_duration = registry.histogram(
+    "cbr_request_duration_seconds", "CBR HTTP attempt latency", ("path", "status")
+)
+cbr_retries = registry.counter("cbr_retries_total", "Retried CBR attempts", ("path",))
+cbr_failures = registry.counter(
+    "cbr_failures_total", "CBR requests that failed after retries or were short-circuited", ("path", "reason")
+)
+cbr_parse_duration = registry.histogram(
+    "cbr_parse_duration_seconds", "CPU time spent parsing CBR XML", ("document",), FAST_BUCKETS
+)
+rate_loads = registry.counter(
+    "rate_loads_total", "Rate loads by outcome: fetched from CBR or found saved by another process", ("result",)
+)
+
+
+def statement_operation(statement: str) -> str:
+    # Первое слово запроса: SELECT, INSERT, ... - ограниченное число меток
+    head = statement.lstrip()[:16].split(None, 1)
+    return head[0].upper() if head else "UNKNOWN"
+
+
+class _RequestProfiler:
+    """Профилирует выборку запросов и пишет в лог профиль медленных.
+
+    cProfile видит весь поток, а не только свою корутину, поэтому
+    одновременно профилируется не больше одного запроса.
+    """
+
+    def __init__(self, sample_rate: float, slow_ms: float, top: int):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.top = top
+        self._active = False
+
+    def start(self) -> cProfile.Profile | None:
+        if self._active or not self.sample_rate or random.random() >= self.sample_rate:
+            return None
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile: cProfile.Profile, method: str, path: str, elapsed: float) -> None:
+        profile.disable()
+        self._active = False
+        if elapsed * 1000 < self.slow_ms:
+            return
+
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).sort_stats("tottime").print_stats(self.top)
+        logger.warning(f"Slow request {method} {path} took {elapsed * 1000:.1f}ms, profile:\n{output.getvalue()}")
+
+
+request_profiler = _RequestProfiler(PROFILE_SAMPLE_RATE, PROFILE_SLOW_MS, PROFILE_TOP)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма задержек по шаблону маршрута и
+    выборочное профилирование. Шаблон (/exchange-rates/{currency_code}),
+    а не сам путь, чтобы число рядов не росло с числом валют и дат."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        profile = request_profiler.start()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = scope.get("route")
+            http_request_duration.observe(
+                elapsed, scope["method"], route.path if route is not None else "unmatched", status
+            )
+            if profile is not None:
+                request_profiler.finish(profile, scope["method"], scope["path"], elapsed)
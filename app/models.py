@@ -1,11 +1,16 @@
-from sqlalchemy import Column, Date, String, Numeric, Integer, Index
+from sqlalchemy import Column, Date, DateTime, Float, String, Numeric, Integer, Index, func
 from app.database import Base
 
 class CurrencyRate(Base):
+    """Курсы ЦБ, секционированы по годам (app.partitions).
+
+    Первичный и уникальные ключи секционированной таблицы обязаны
+    включать дату, поэтому первичный ключ - (id, date).
+    """
     __tablename__ = "currency_rate"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    date = Column(Date, nullable=False)
+    date = Column(Date, primary_key=True)
     currency_code = Column(String(3), nullable=False)
     name = Column(String(100))
     rate = Column(Numeric(12, 6))
@@ -13,4 +18,88 @@ class CurrencyRate(Base):
 
     __table_args__ = (
         Index('idx_date_currency', 'date', 'currency_code', unique=True),
+        # История одной валюты: поиск по коду и диапазон по дате, курс и
+        # номинал берутся прямо из индекса (index-only scan)
+        Index(
+            'idx_currency_date', 'currency_code', 'date',
+            postgresql_include=['rate', 'nominal'],
+        ),
+        # Курсы пишутся по возрастанию даты, и BRIN по ней занимает
+        # несколько страниц на секцию - для диапазонов по всем валютам
+        Index(
+            'idx_currency_rate_date_brin', 'date',
+            postgresql_using='brin',
+            postgresql_with={'pages_per_range': 8},
+        ),
+        {'postgresql_partition_by': 'RANGE (date)'},
     )
+
+
+class EffectiveDate(Base):
+    """Дата, за которую ЦБ фактически вернул курсы на запрошенную дату.
+
+    На выходные и праздники ЦБ отдаёт курсы предыдущего рабочего дня.
+    effective_date = NULL означает, что курсов на дату у ЦБ нет.
+    """
+    __tablename__ = "rate_effective_date"
+
+    requested_date = Column(Date, primary_key=True)
+    effective_date = Column(Date, nullable=True)
+    checked_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class RateSnapshot(Base):
+    """Хэш содержимого курсов за дату для ETag/Last-Modified.
+
+    Пересчитывается при сохранении курсов; updated_at меняется, только
+    если изменился сам хэш.
+    """
+    __tablename__ = "rate_snapshot"
+
+    date = Column(Date, primary_key=True)
+    etag = Column(String(32), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class RateDailyChange(Base):
+    """Изменение курса валюты к предыдущей дате курсов.
+
+    value - курс за одну единицу валюты (rate / nominal), поэтому смена
+    номинала не выглядит скачком. volatility - стандартное отклонение
+    логарифмических доходностей за последние rollups.VOLATILITY_WINDOW дат.
+    """
+    __tablename__ = "rate_daily_change"
+
+    currency_code = Column(String(3), primary_key=True)
+    date = Column(Date, primary_key=True)
+    value = Column(Numeric(20, 10), nullable=False)
+    prev_date = Column(Date)
+    change = Column(Numeric(20, 10))
+    change_pct = Column(Float)
+    log_return = Column(Float)
+    volatility = Column(Float)
+
+
+class RatePeriodStats(Base):
+    """Агрегаты курса валюты за месяц или год по rate_daily_change.
+
+    Суммы доходностей хранятся, чтобы волатильность за период считалась
+    без чтения дневных строк, а годовые строки собирались из месячных.
+    """
+    __tablename__ = "rate_period_stats"
+
+    currency_code = Column(String(3), primary_key=True)
+    period = Column(String(5), primary_key=True)
+    period_start = Column(Date, primary_key=True)
+    days = Column(Integer, nullable=False)
+    first_date = Column(Date, nullable=False)
+    last_date = Column(Date, nullable=False)
+    open_value = Column(Numeric(20, 10), nullable=False)
+    close_value = Column(Numeric(20, 10), nullable=False)
+    min_value = Column(Numeric(20, 10), nullable=False)
+    max_value = Column(Numeric(20, 10), nullable=False)
+    avg_value = Column(Numeric(20, 10), nullable=False)
+    sum_value = Column(Numeric(30, 10), nullable=False)
+    returns = Column(Integer, nullable=False)
+    sum_return = Column(Float)
+    sum_return_sq = Column(Float)
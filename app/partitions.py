@@ -0,0 +1,104 @@
+"""Годовые секции currency_rate.
+
+Таблица секционирована по диапазону дат (миграция 9b6e2f4a7c13). Секция
+на год создаётся перед первой записью курсов за этот год, а следующий год
+заводится заранее, чтобы в новогоднюю ночь запись не ждала DDL. Известные
+годы запоминаются в процессе: обычная запись не делает лишних запросов.
+"""
+import logging
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+RATE_TABLE = "currency_rate"
+# Сколько ждать блокировку таблицы под DDL: длинное чтение истории не
+# должно останавливать запись курсов
+PARTITION_LOCK_TIMEOUT = "5s"
+# Ключ advisory-блокировки: секцию создаёт один процесс, остальные ждут
+PARTITION_LOCK_KEY = 0x43425203
+
+_known_years: set[int] = set()
+
+_PARTITIONING = text("""
+SELECT c.relkind = 'p' AS partitioned,
+       array(
+           SELECT child.relname::text FROM pg_inherits i
+           JOIN pg_class child ON child.oid = i.inhrelid
+           WHERE i.inhparent = c.oid
+       ) AS partitions
+FROM pg_class c
+WHERE c.oid = to_regclass(:table)
+""")
+
+
+def partition_name(year: int) -> str:
+    return f"{RATE_TABLE}_y{year}"
+
+
+def partition_ddl(year: int) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(year)} PARTITION OF {RATE_TABLE} "
+        f"FOR VALUES FROM ('{year:04d}-01-01') TO ('{year + 1:04d}-01-01')"
+    )
+
+
+class PartitionUnavailableError(Exception):
+    """Секции под записываемые даты нет, и создать её не удалось."""
+
+
+async def _missing_partitions(years: set[int]) -> set[int]:
+    # Только чтение каталога: блокировок таблицы не берёт
+    async with engine.connect() as conn:
+        row = (await conn.execute(_PARTITIONING, {"table": RATE_TABLE})).first()
+    if row is None or not row.partitioned:
+        return set()
+    existing = set(row.partitions)
+    return {year for year in years if partition_name(year) not in existing}
+
+
+async def ensure_rate_partitions(dates: Iterable[date]) -> None:
+    """Создаёт недостающие секции для лет из dates и следующего года.
+
+    Отдельная короткая транзакция: DDL не должен держать блокировки до
+    конца записи курсов. Если создать секцию не вышло (например, истёк
+    lock_timeout), а для лет из dates её нет, поднимает
+    PartitionUnavailableError: запись в таблицу всё равно бы не прошла.
+    Неудача с заготовкой на следующий год запись не останавливает.
+    """
+    needed = {day.year for day in dates}
+    years = needed | {date.today().year + 1}
+    missing = years - _known_years
+    if not missing:
+        return
+
+    try:
+        async with engine.begin() as conn:
+            await conn.execute(
+                text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": PARTITION_LOCK_TIMEOUT}
+            )
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+            row = (await conn.execute(_PARTITIONING, {"table": RATE_TABLE})).first()
+            # Таблица ещё не секционирована (миграция не применена) - писать можно как есть
+            if row is not None and row.partitioned:
+                existing = set(row.partitions)
+                for year in sorted(missing):
+                    if partition_name(year) not in existing:
+                        await conn.execute(text(partition_ddl(year)))
+                        logger.info(f"Created partition {partition_name(year)}")
+    except DBAPIError as e:
+        # Не помечаем годы известными: следующая запись попробует снова
+        logger.warning(f"Failed to create partitions for {sorted(missing)}: {e}")
+        absent = await _missing_partitions(needed & missing)
+        if absent:
+            raise PartitionUnavailableError(
+                f"No partitions of {RATE_TABLE} for {sorted(absent)}, retry later"
+            ) from e
+        return
+
+    _known_years.update(missing)
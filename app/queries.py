@@ -0,0 +1,80 @@
+"""Горячие чтения напрямую через asyncpg, мимо ORM-сессии.
+
+Запросы - готовый SQL с $1, $2...: компиляции SQLAlchemy нет, а asyncpg
+готовит каждый текст один раз на соединение (кэш prepared statements) и
+дальше передаёт только параметры. Строки - asyncpg.Record: доступ по
+имени колонки, как у словаря, без промежуточных объектов. Соединение
+берётся из пула движка только на время запроса.
+"""
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from asyncpg import Connection, Record
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.database import engine, read_engine
+from app.metrics import db_statement_duration, db_statement_errors
+
+
+class Queries:
+    """Чтения через пул одного движка: основной базы или реплики."""
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.queries = 0
+        self.errors = 0
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[Connection]:
+        # Соединение пула: при возврате SQLAlchemy сам сделает rollback
+        async with self.engine.connect() as conn:
+            yield (await conn.get_raw_connection()).driver_connection
+
+    @asynccontextmanager
+    async def _timed(self):
+        # События SQLAlchemy сюда не доходят, метрики запросов пишем сами
+        self.queries += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors += 1
+            db_statement_errors.inc("SELECT")
+            raise
+        finally:
+            db_statement_duration.observe(time.perf_counter() - started, "SELECT")
+
+    async def fetch(self, query: str, *args) -> list[Record]:
+        async with self.connection() as conn, self._timed():
+            return await conn.fetch(query, *args)
+
+    async def fetchrow(self, query: str, *args) -> Record | None:
+        async with self.connection() as conn, self._timed():
+            return await conn.fetchrow(query, *args)
+
+    async def cursor(self, query: str, *args, fetch_size: int) -> AsyncIterator[list[Record]]:
+        """Строки серверного курсора пачками по fetch_size.
+
+        Курсор живёт только внутри транзакции, соединение занято, пока
+        генератор не исчерпан или не закрыт.
+        """
+        async with self.connection() as conn:
+            async with conn.transaction():
+                async with self._timed():
+                    cursor = await conn.cursor(query, *args)
+                while True:
+                    async with self._timed():
+                        rows = await cursor.fetch(fetch_size)
+                    if not rows:
+                        break
+                    yield rows
+
+    def stats(self) -> dict:
+        return {'queries': self.queries, 'errors': self.errors}
+
+
+# Чтения API - с реплики (или отдельного пула основной базы)
+read_queries = Queries(read_engine)
+# Сразу после своей записи или уведомления о ней: реплика может отставать
+primary_queries = Queries(engine)
@@ -0,0 +1,348 @@
+"""Предрасчитанная статистика курсов: дневные изменения, месячные и
+годовые агрегаты.
+
+save_rates обновляет затронутые строки в своей транзакции: изменённые
+даты, следующую за каждой из них дату (у неё поменялся предыдущий курс) и
+окно волатильности после них. После бэкфилла таблицы перестраиваются
+целиком. Чтение статистики - диапазон по первичному ключу, без агрегации
+по дням.
+"""
+import logging
+import math
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import Date, Float, String, bindparam, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import RateDailyChange, RatePeriodStats
+
+logger = logging.getLogger(__name__)
+
+# Число дат в окне скользящей волатильности. Часть данных, а не настройка:
+# при изменении таблицы нужно перестроить
+VOLATILITY_WINDOW = 30
+
+# Курс за единицу; строки без курса или с нулевым номиналом не участвуют
+_UNIT_VALUE = "round(rate / nominal, 10)"
+_VALID_RATE = "rate IS NOT NULL AND nominal > 0"
+
+_CHANGE_COLUMNS = """
+    value - prev_value AS change,
+    CASE WHEN prev_value > 0 THEN (value / prev_value - 1) * 100 END AS change_pct,
+    CASE WHEN prev_value > 0 AND value > 0 THEN ln((value / prev_value)::float8) END AS log_return
+"""
+
+_UPSERT_DAILY = """
+ON CONFLICT (currency_code, date) DO UPDATE SET
+    value = EXCLUDED.value,
+    prev_date = EXCLUDED.prev_date,
+    change = EXCLUDED.change,
+    change_pct = EXCLUDED.change_pct,
+    log_return = EXCLUDED.log_return
+"""
+
+# Диапазон изменённых дат по каждой валюте
+_CHANGED_BOUNDS = """
+bounds AS (
+    SELECT currency_code, min(date) AS first_date, max(date) AS last_date
+    FROM currency_rate
+    WHERE date = ANY(:dates)
+    GROUP BY currency_code
+)
+"""
+
+_REFRESH_DAILY = text(f"""
+WITH {_CHANGED_BOUNDS},
+targets AS (
+    SELECT r.currency_code, r.date, r.rate, r.nominal
+    FROM bounds b
+    JOIN currency_rate r
+      ON r.currency_code = b.currency_code AND r.date BETWEEN b.first_date AND b.last_date
+    UNION ALL
+    SELECT b.currency_code, n.date, n.rate, n.nominal
+    FROM bounds b
+    CROSS JOIN LATERAL (
+        SELECT date, rate, nominal FROM currency_rate
+        WHERE currency_code = b.currency_code AND date > b.last_date AND {_VALID_RATE}
+        ORDER BY date
+        LIMIT 1
+    ) n
+),
+computed AS (
+    SELECT t.currency_code, t.date, round(t.rate / t.nominal, 10) AS value,
+           p.date AS prev_date, p.value AS prev_value
+    FROM targets t
+    LEFT JOIN LATERAL (
+        SELECT date, {_UNIT_VALUE} AS value FROM currency_rate
+        WHERE currency_code = t.currency_code AND date < t.date AND {_VALID_RATE}
+        ORDER BY date DESC
+        LIMIT 1
+    ) p ON true
+    WHERE t.rate IS NOT NULL AND t.nominal > 0
+)
+INSERT INTO rate_daily_change (currency_code, date, value, prev_date, change, change_pct, log_return)
+SELECT currency_code, date, value, prev_date, {_CHANGE_COLUMNS}
+FROM computed
+{_UPSERT_DAILY}
+RETURNING currency_code, date
+""").bindparams(bindparam('dates', type_=ARRAY(Date)))
+
+# Волатильность меняется у изменённых дат и у VOLATILITY_WINDOW дат после них:
+# доходность следующей даты тоже изменилась, и она входит в окна ещё
+# VOLATILITY_WINDOW - 1 дат. Окно - те же строки, что у оконной функции
+# при полной перестройке
+_SELECT_VOLATILITY = text(f"""
+WITH {_CHANGED_BOUNDS},
+affected AS (
+    SELECT d.currency_code, d.date
+    FROM bounds b
+    JOIN rate_daily_change d
+      ON d.currency_code = b.currency_code AND d.date BETWEEN b.first_date AND b.last_date
+    UNION
+    SELECT b.currency_code, n.date
+    FROM bounds b
+    CROSS JOIN LATERAL (
+        SELECT date FROM rate_daily_change
+        WHERE currency_code = b.currency_code AND date > b.last_date
+        ORDER BY date
+        LIMIT {VOLATILITY_WINDOW}
+    ) n
+)
+SELECT a.currency_code, a.date, (
+    SELECT stddev_samp(w.log_return) FROM (
+        SELECT log_return FROM rate_daily_change
+        WHERE currency_code = a.currency_code AND date <= a.date
+        ORDER BY date DESC
+        LIMIT {VOLATILITY_WINDOW}
+    ) w
+)
+FROM affected a
+""").bindparams(bindparam('dates', type_=ARRAY(Date)))
+
+# Отдельным запросом по массивам: в UPDATE ... FROM affected планировщик
+# переоценивает число строк и читает таблицу целиком
+_UPDATE_VOLATILITY = text("""
+UPDATE rate_daily_change t
+SET volatility = v.volatility
+FROM unnest(:codes, :dates, :volatilities) AS v(currency_code, date, volatility)
+WHERE t.currency_code = v.currency_code AND t.date = v.date
+""").bindparams(
+    bindparam('codes', type_=ARRAY(String)),
+    bindparam('dates', type_=ARRAY(Date)),
+    bindparam('volatilities', type_=ARRAY(Float)),
+)
+
+_PERIOD_COLUMNS = """
+    currency_code, period, period_start, days, first_date, last_date,
+    open_value, close_value, min_value, max_value, avg_value, sum_value,
+    returns, sum_return, sum_return_sq
+"""
+
+_UPSERT_PERIOD = """
+ON CONFLICT (currency_code, period, period_start) DO UPDATE SET
+    days = EXCLUDED.days,
+    first_date = EXCLUDED.first_date,
+    last_date = EXCLUDED.last_date,
+    open_value = EXCLUDED.open_value,
+    close_value = EXCLUDED.close_value,
+    min_value = EXCLUDED.min_value,
+    max_value = EXCLUDED.max_value,
+    avg_value = EXCLUDED.avg_value,
+    sum_value = EXCLUDED.sum_value,
+    returns = EXCLUDED.returns,
+    sum_return = EXCLUDED.sum_return,
+    sum_return_sq = EXCLUDED.sum_return_sq
+"""
+
+
+def _month_sql(source: str) -> str:
+    return f"""
+INSERT INTO rate_period_stats ({_PERIOD_COLUMNS})
+SELECT d.currency_code, 'month', date_trunc('month', d.date)::date,
+       count(*), min(d.date), max(d.date),
+       (array_agg(d.value ORDER BY d.date))[1],
+       (array_agg(d.value ORDER BY d.date DESC))[1],
+       min(d.value), max(d.value), round(avg(d.value), 10), sum(d.value),
+       count(d.log_return), sum(d.log_return), sum(d.log_return * d.log_return)
+FROM {source}
+GROUP BY d.currency_code, date_trunc('month', d.date)
+{_UPSERT_PERIOD}
+"""
+
+
+def _year_sql(source: str) -> str:
+    # Год собирается из месяцев: не больше 12 строк на валюту
+    return f"""
+INSERT INTO rate_period_stats ({_PERIOD_COLUMNS})
+SELECT m.currency_code, 'year', date_trunc('year', m.period_start)::date,
+       sum(m.days), min(m.first_date), max(m.last_date),
+       (array_agg(m.open_value ORDER BY m.period_start))[1],
+       (array_agg(m.close_value ORDER BY m.period_start DESC))[1],
+       min(m.min_value), max(m.max_value), round(sum(m.sum_value) / sum(m.days), 10), sum(m.sum_value),
+       sum(m.returns), sum(m.sum_return), sum(m.sum_return_sq)
+FROM {source}
+WHERE m.period = 'month'
+GROUP BY m.currency_code, date_trunc('year', m.period_start)
+{_UPSERT_PERIOD}
+"""
+
+
+_PERIOD_KEYS = "unnest(:codes, :periods) AS k(currency_code, period_start)"
+
+_REFRESH_MONTHS = text(_month_sql(f"""{_PERIOD_KEYS}
+JOIN rate_daily_change d
+  ON d.currency_code = k.currency_code
+ AND d.date >= k.period_start AND d.date < (k.period_start + interval '1 month')::date""")).bindparams(
+    bindparam('codes', type_=ARRAY(String)),
+    bindparam('periods', type_=ARRAY(Date)),
+)
+
+_REFRESH_YEARS = text(_year_sql(f"""{_PERIOD_KEYS}
+JOIN rate_period_stats m
+  ON m.currency_code = k.currency_code
+ AND m.period_start >= k.period_start AND m.period_start < (k.period_start + interval '1 year')::date""")).bindparams(
+    bindparam('codes', type_=ARRAY(String)),
+    bindparam('periods', type_=ARRAY(Date)),
+)
+
+_REBUILD_SQL = (
+    "TRUNCATE rate_daily_change, rate_period_stats",
+    f"""
+INSERT INTO rate_daily_change
+    (currency_code, date, value, prev_date, change, change_pct, log_return, volatility)
+SELECT currency_code, date, value, prev_date, change, change_pct, log_return,
+       stddev_samp(log_return) OVER (
+           PARTITION BY currency_code ORDER BY date
+           ROWS BETWEEN {VOLATILITY_WINDOW - 1} PRECEDING AND CURRENT ROW
+       )
+FROM (
+    SELECT currency_code, date, value, prev_date, {_CHANGE_COLUMNS}
+    FROM (
+        SELECT currency_code, date, {_UNIT_VALUE} AS value,
+               lag(date) OVER w AS prev_date,
+               lag({_UNIT_VALUE}) OVER w AS prev_value
+        FROM currency_rate
+        WHERE {_VALID_RATE}
+        WINDOW w AS (PARTITION BY currency_code ORDER BY date)
+    ) lagged
+) changes
+""",
+    _month_sql("rate_daily_change d"),
+    _year_sql("rate_period_stats m"),
+)
+
+
+def _month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+async def refresh_rollups(session: AsyncSession, dates: Iterable[date]) -> int:
+    """Пересчёт статистики после записи курсов на dates, без коммита.
+
+    Возвращает число пересчитанных дневных строк.
+    """
+    dates = list(dates)
+    if not dates:
+        return 0
+
+    result = await session.execute(_REFRESH_DAILY, {'dates': dates})
+    daily = result.all()
+    volatility = (await session.execute(_SELECT_VOLATILITY, {'dates': dates})).all()
+    if volatility:
+        codes, days, values = zip(*volatility)
+        await session.execute(_UPDATE_VOLATILITY, {
+            'codes': list(codes), 'dates': list(days), 'volatilities': list(values),
+        })
+
+    months = {(code, _month_start(day)) for code, day in daily}
+    if months:
+        codes, periods = zip(*sorted(months))
+        await session.execute(_REFRESH_MONTHS, {'codes': list(codes), 'periods': list(periods)})
+
+        years = sorted({(code, period.replace(month=1)) for code, period in months})
+        codes, periods = zip(*years)
+        await session.execute(_REFRESH_YEARS, {'codes': list(codes), 'periods': list(periods)})
+
+    return len(daily)
+
+
+async def rebuild_rollups(session: AsyncSession) -> None:
+    """Полная перестройка статистики по currency_rate (после бэкфилла).
+
+    TRUNCATE блокирует чтение статистики до коммита - для разовой операции
+    это дешевле, чем построчно обновлять сотни тысяч строк.
+    """
+    for statement in _REBUILD_SQL:
+        await session.execute(text(statement))
+    await session.commit()
+    logger.info("Rate rollups rebuilt")
+
+
+def _volatility(count: int, total: float | None, squares: float | None) -> float | None:
+    # Выборочное стандартное отклонение по сохранённым суммам
+    if count < 2 or total is None or squares is None:
+        return None
+    return math.sqrt(max(0.0, (squares - total * total / count) / (count - 1)))
+
+
+def _float(value) -> float | None:
+    return float(value) if value is not None else None
+
+
+async def get_rate_stats(
+    session: AsyncSession,
+    currency_code: str,
+    period: str,
+    start: date | None,
+    end: date,
+    limit: int,
+) -> list[dict]:
+    """Статистика валюты за period (day, month или year) по возрастанию
+    даты. Курсы - за одну единицу валюты."""
+    if period == 'day':
+        query = select(RateDailyChange).where(
+            RateDailyChange.currency_code == currency_code,
+            RateDailyChange.date <= end,
+        )
+        if start is not None:
+            query = query.where(RateDailyChange.date >= start)
+        result = await session.scalars(query.order_by(RateDailyChange.date).limit(limit))
+        return [
+            {
+                'date': row.date.isoformat(),
+                'unit_rate': float(row.value),
+                'prev_date': row.prev_date.isoformat() if row.prev_date else None,
+                'change': _float(row.change),
+                'change_pct': row.change_pct,
+                'volatility': row.volatility,
+            }
+            for row in result
+        ]
+
+    query = select(RatePeriodStats).where(
+        RatePeriodStats.currency_code == currency_code,
+        RatePeriodStats.period == period,
+        RatePeriodStats.period_start <= end,
+    )
+    if start is not None:
+        query = query.where(RatePeriodStats.period_start >= start)
+    result = await session.scalars(query.order_by(RatePeriodStats.period_start).limit(limit))
+    return [
+        {
+            'period_start': row.period_start.isoformat(),
+            'first_date': row.first_date.isoformat(),
+            'last_date': row.last_date.isoformat(),
+            'days': row.days,
+            'open': float(row.open_value),
+            'close': float(row.close_value),
+            'min': float(row.min_value),
+            'max': float(row.max_value),
+            'avg': float(row.avg_value),
+            'change': float(row.close_value - row.open_value),
+            'change_pct': float((row.close_value / row.open_value - 1) * 100) if row.open_value else None,
+            'volatility': _volatility(row.returns, row.sum_return, row.sum_return_sq),
+        }
+        for row in result
+    ]
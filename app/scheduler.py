@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from datetime import date, datetime, time, timedelta
+
+from app.crud import get_cached_rates
+from app.database import try_advisory_lock
+from app.loader import load_cbr_rates
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+# Как часто проверять курсы, секунды
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "600"))
+# С какого часа (локальное время сервера) ждать курсы на завтра: ЦБ
+# публикует их во второй половине дня
+PREFETCH_FROM_HOUR = int(os.getenv("PREFETCH_FROM_HOUR", "12"))
+# Через сколько секунд после полуночи запускать внеочередной прогон
+PREFETCH_MIDNIGHT_DELAY = float(os.getenv("PREFETCH_MIDNIGHT_DELAY", "1"))
+
+# Ключ advisory-блокировки: задачу выполняет один процесс из всех воркеров
+PREFETCH_LOCK_KEY = 0x43425201
+
+
+class PrefetchScheduler:
+    """Фоновая загрузка курсов на сегодня и завтра, чтобы запросы к API
+    не ждали ЦБ.
+
+    Загрузку выполняет тот воркер, который взял advisory-блокировку, а
+    прогревает свой кэш каждый воркер. Кроме прогонов раз в interval есть
+    прогон сразу после полуночи: записи кэша на завтра живут недолго, а
+    соответствие для выходного или праздника можно сохранить только в сам
+    день, так что без него первые запросы нового дня шли бы в ЦБ.
+    """
+
+    def __init__(self, interval: float = PREFETCH_INTERVAL, from_hour: int = PREFETCH_FROM_HOUR,
+                 midnight_delay: float = PREFETCH_MIDNIGHT_DELAY):
+        self.interval = interval
+        self.from_hour = from_hour
+        self.midnight_delay = midnight_delay
+        self._task: asyncio.Task | None = None
+
+        self.runs = 0
+        self.loads = 0
+        self.last_run: datetime | None = None
+        self.last_error: str | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Prefetch scheduler started, interval {self.interval}s")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _targets(self, now: datetime) -> list[date]:
+        today = now.date()
+        if now.hour >= self.from_hour:
+            return [today, today + timedelta(days=1)]
+        return [today]
+
+    def _next_delay(self, now: datetime) -> float:
+        next_run = datetime.combine(now.date() + timedelta(days=1), time()) + timedelta(seconds=self.midnight_delay)
+        return max(0.0, min(self.interval, (next_run - now).total_seconds()))
+
+    async def _ensure_loaded(self, target_date: date) -> None:
+        if await get_cached_rates(target_date, primary=True) is not None:
+            return
+
+        cbr_date = await load_cbr_rates(target_date)
+        self.loads += 1
+        logger.info(f"Prefetched rates for {target_date}, CBR date {cbr_date}")
+
+    async def _warm(self, targets: list[date]) -> None:
+        # С основной базы, как и прогрев по уведомлениям: курсы только что записаны
+        for target_date in targets:
+            await get_cached_rates(target_date, primary=True)
+
+    async def run_once(self, now: datetime | None = None) -> None:
+        targets = self._targets(now or datetime.now())
+
+        async with try_advisory_lock(PREFETCH_LOCK_KEY) as acquired:
+            if acquired:
+                for target_date in targets:
+                    await self._ensure_loaded(target_date)
+
+        await self._warm(targets)
+        self.runs += 1
+        self.last_run = datetime.now()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+                self.last_error = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.exception("Prefetch run failed")
+
+            await asyncio.sleep(self._next_delay(datetime.now()))
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self._task is not None,
+            'interval': self.interval,
+            'runs': self.runs,
+            'loads': self.loads,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'last_error': self.last_error,
+        }
+
+
+prefetch_scheduler = PrefetchScheduler()
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, Field, field_validator
 from datetime import date as DateType
+from typing import Optional, Union
 import re
 
 class CurrencyRateSchema(BaseModel):
@@ -18,3 +19,35 @@ class CurrencyRateSchema(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class RateLookupSchema(BaseModel):
+    currency_code: str
+    date: DateType
+
+    @field_validator('currency_code')
+    def normalize_currency_code(cls, v):
+        # Неверный код не должен ронять весь пакет: такая пара просто не найдётся
+        return v.strip().upper()
+
+
+class BatchRateResultSchema(BaseModel):
+    currency_code: str
+    date: DateType
+    found: bool
+    rate: Optional[CurrencyRateSchema] = None
+
+
+class ConvertBatchRequest(BaseModel):
+    """Пересчёт массива сумм. from/to - один код на все суммы или список
+    той же длины, что amounts."""
+    date: Optional[DateType] = None
+    from_currency: Union[str, list[str]] = Field(alias='from')
+    to_currency: Union[str, list[str]] = Field(alias='to')
+    amounts: list[float]
+
+    @field_validator('from_currency', 'to_currency')
+    def normalize_currency_codes(cls, v):
+        if isinstance(v, str):
+            return [v.strip().upper()]
+        return [code.strip().upper() for code in v]
@@ -0,0 +1,40 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Схлопывает конкурентные вызовы с одинаковым ключом в один.
+
+    Первый вызов запускает задачу, остальные ждут её же результат или
+    исключение. После завершения ключ освобождается, поэтому ошибка не
+    "залипает" и следующий вызов начнёт работу заново.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+        else:
+            logger.debug(f"Joining in-flight call for {key}")
+
+        # shield: отмена одного ожидающего (клиент отключился) не должна
+        # отменять общую задачу для остальных
+        return await asyncio.shield(task)
+
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Помечаем исключение как полученное, даже если все ожидающие ушли
+        if not task.cancelled():
+            task.exception()
@@ -1,96 +1,81 @@
-from datetime import date, datetime
-import aiohttp
-from fastapi import HTTPException
+from datetime import date
 from lxml import etree
 import logging
-import xml.etree.ElementTree as ET
+
+from app.cbr_client import cbr_client
+from app.cbr_parser import RateRecord, parse_cbr_response
 
 
 logger = logging.getLogger(__name__)
 
 
-async def fetch_cbr_rates(target_date: date) -> list[dict]:
-    url = f"https://www.cbr.ru/scripts/XML_daily.asp?date_req={target_date.strftime('%d/%m/%Y')}"
+def _cbr_date(target_date: date) -> str:
+    return target_date.strftime('%d/%m/%Y')
+
+
+async def fetch_cbr_rates(target_date: date) -> list[RateRecord] | None:
+    """Курсы ЦБ на дату. [] - корректный документ без курсов, None - ответа
+    не получили (не 200) или он не разобрался."""
+    try:
+        rates = await cbr_client.fetch(
+            "XML_daily.asp",
+            {'date_req': _cbr_date(target_date)},
+            consume=parse_cbr_response,
+        )
+    except etree.XMLSyntaxError as e:
+        logger.error(f"Invalid XML_daily response for {target_date}: {e}")
+        return None
+
+    return rates
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as response:
-            if response.status != 200:
-                return []
 
-            text = await response.text()
+async def fetch_cbr_currencies() -> list[dict]:
+    """Справочник валют ЦБ (XML_valFull) с внутренними ID для XML_dynamic."""
+    body = await cbr_client.fetch("XML_valFull.asp")
+    if body is None:
+        return []
 
     try:
-        root = ET.fromstring(text)
-        date_str = root.attrib.get('Date')
-        cbr_date = datetime.strptime(date_str, "%d.%m.%Y").date()
-    except Exception:
+        root = etree.fromstring(body)
+    except etree.XMLSyntaxError as e:
+        logger.error(f"Invalid XML_valFull response: {e}")
         return []
 
-    rates = []
-    for valute in root.findall('Valute'):
-        try:
-            char_code = valute.find('CharCode').text
-            name = valute.find('Name').text
-            nominal = int(valute.find('Nominal').text)
-            rate_str = valute.find('Value').text.replace(',', '.')
-            rate = float(rate_str)
-        except Exception:
+    currencies = []
+    for item in root.iterfind('Item'):
+        char_code = (item.findtext('ISO_Char_Code') or '').strip()
+        if not char_code:
             continue
 
-        rates.append({
-            'date': cbr_date,
+        currencies.append({
+            'cbr_id': item.get('ID').strip(),
             'currency_code': char_code,
-            'name': name,
-            'rate': rate,
-            'nominal': nominal,
+            'name': (item.findtext('Name') or '').strip(),
         })
 
-    return rates
-def parse_xml(xml_content: str, fallback_date: date) -> list:
+    return currencies
+
+
+async def fetch_cbr_dynamic(currency: dict, start: date, end: date) -> list[RateRecord]:
+    """Курсы одной валюты за диапазон дат (XML_dynamic).
+
+    currency - элемент из fetch_cbr_currencies.
+    """
+    async def consume(response):
+        return await parse_cbr_response(response, currency)
+
     try:
-        root = etree.fromstring(xml_content.encode('windows-1251'))
-        rates = []
-
-        date_str = root.get('Date')
-        parsed_date = fallback_date
-        if date_str:
-            try:
-                parsed_date = datetime.strptime(date_str, "%d.%m.%Y").date()
-            except ValueError:
-                logger.warning(f"Invalid date format: {date_str}, using fallback")
-
-        for valute in root.findall('Valute'):
-            try:
-                char_code = valute.find('CharCode').text
-                name = valute.find('Name').text
-                nominal = valute.find('Nominal').text
-                value = valute.find('Value').text
-
-                if not char_code or not value:
-                    continue
-
-                rates.append({
-                    'date': parsed_date,
-                    'currency_code': char_code.strip(),
-                    'name': name.strip() if name else "",
-                    'nominal': int(nominal) if nominal else 1,
-                    'rate': float(value.replace(',', '.'))
-                })
-            except (AttributeError, ValueError, TypeError) as e:
-                logger.error(f"Error parsing Valute: {str(e)}")
-                continue
-
-        logger.info(f"Parsed {len(rates)} currency rates")
-        return rates
+        rates = await cbr_client.fetch(
+            "XML_dynamic.asp",
+            {
+                'date_req1': _cbr_date(start),
+                'date_req2': _cbr_date(end),
+                'VAL_NM_RQ': currency['cbr_id'],
+            },
+            consume=consume,
+        )
     except etree.XMLSyntaxError as e:
-        logger.error(f"XML syntax error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail="Invalid XML response from CBR"
-        ) from e
-    except Exception as e:
-        logger.error(f"XML parsing error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to parse currency data"
-        ) from e
+        logger.error(f"Invalid XML_dynamic response for {currency['currency_code']}: {e}")
+        return []
+
+    return rates or []
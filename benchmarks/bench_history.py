@@ -0,0 +1,119 @@
+"""Время запросов истории курсов к currency_rate.
+
+    history_1y   - crud.stream_rate_history одной валюты за последний год
+    history_5y   - то же за пять лет
+    history_all  - вся история валюты
+    range_month  - все валюты за последний месяц (скан по диапазону дат)
+    range_year   - все валюты за последний год
+    day          - crud.get_rates_by_date на последнюю дату
+
+Скрипт только читает, его можно запускать до и после миграции
+секционирования на одной и той же базе и сравнивать медианы:
+
+    python -m benchmarks.bench_history --code USD --repeat 20
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import func, select
+
+from app.crud import get_rates_by_date, stream_rate_history
+from app.database import AsyncSessionLocal, shutdown_db
+from app.models import CurrencyRate
+
+HISTORY_LIMIT = 100_000
+
+
+async def _history(code: str, start: date, end: date) -> int:
+    rows = 0
+    async for chunk in stream_rate_history(code, start, end, HISTORY_LIMIT):
+        rows += len(chunk)
+    return rows
+
+
+async def _range(start: date, end: date) -> int:
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(CurrencyRate.date, CurrencyRate.currency_code, CurrencyRate.rate, CurrencyRate.nominal)
+            .where(CurrencyRate.date.between(start, end))
+            .order_by(CurrencyRate.date, CurrencyRate.currency_code)
+        )
+        return len(result.all())
+
+
+async def _day(target_date: date) -> int:
+    async with AsyncSessionLocal() as session:
+        return len(await get_rates_by_date(session, target_date))
+
+
+def _scenarios(code: str, first: date, last: date) -> dict:
+    return {
+        'history_1y': lambda: _history(code, last - timedelta(days=365), last),
+        'history_5y': lambda: _history(code, last - timedelta(days=5 * 365), last),
+        'history_all': lambda: _history(code, first, last),
+        'range_month': lambda: _range(last - timedelta(days=30), last),
+        'range_year': lambda: _range(last - timedelta(days=365), last),
+        'day': lambda: _day(last),
+    }
+
+
+async def run(code: str, repeat: int, scenarios: list[str] | None = None) -> list[dict]:
+    async with AsyncSessionLocal() as session:
+        first, last = (await session.execute(
+            select(func.min(CurrencyRate.date), func.max(CurrencyRate.date))
+            .where(CurrencyRate.currency_code == code)
+        )).one()
+    if first is None:
+        raise SystemExit(f"No rates for {code}")
+
+    available = _scenarios(code, first, last)
+    results = []
+    for name in scenarios or list(available):
+        query = available[name]
+        rows = await query()  # прогрев кэша страниц и пула
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await query()
+            timings.append((time.perf_counter() - started) * 1000)
+
+        results.append({
+            'scenario': name,
+            'rows': rows,
+            'repeat': repeat,
+            'median_ms': round(statistics.median(timings), 3),
+            'min_ms': round(min(timings), 3),
+            'max_ms': round(max(timings), 3),
+        })
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--code', default='USD', help="валюта для запросов истории")
+    parser.add_argument('--repeat', type=int, default=20, help="повторов каждого запроса")
+    parser.add_argument('--scenarios', default=None, help="через запятую, по умолчанию все")
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    try:
+        results = await run(args.code, args.repeat, args.scenarios.split(',') if args.scenarios else None)
+    finally:
+        await shutdown_db()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'scenario':<14}{'rows':>10}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for result in results:
+        print(f"{result['scenario']:<14}{result['rows']:>10}{result['median_ms']:>12.3f}"
+              f"{result['min_ms']:>10.3f}{result['max_ms']:>10.3f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""Микробенчмарк разбора ответов ЦБ на файлах из benchmarks/data.
+
+    etree    - прежний fetch_cbr_rates: ElementTree.fromstring по тексту, find() на поле
+    reencode - прежний parse_xml: текст -> windows-1251 -> lxml.fromstring, find() на поле
+    stream   - app.cbr_parser.parse_cbr_xml: потоковый разбор CBRParser кусками
+
+Каждая стратегия запускается в отдельном процессе, чтобы пиковая память
+(прирост VmHWM) не смешивалась между прогонами:
+
+    python -m benchmarks.bench_parser --repeat 50
+    python -m benchmarks.bench_parser --scale 20 --json
+"""
+import argparse
+import json
+import multiprocessing
+import time
+import xml.etree.ElementTree as ET
+from decimal import Decimal
+from pathlib import Path
+
+from lxml import etree
+
+from app.cbr_parser import RateRecord, _parse_cbr_date, parse_cbr_xml
+from benchmarks.fixtures import DATA_DIR
+
+CURRENCY = {'currency_code': 'USD', 'name': 'Доллар США'}
+
+
+def _tree_records(root) -> list[RateRecord]:
+    # Обход готового дерева, как в прежних парсерах: find() на каждое поле
+    records = []
+    root_date = root.get('Date')
+    for item in [*root.iter('Valute'), *root.iter('Record')]:
+        if item.tag == 'Valute':
+            record_date = _parse_cbr_date(root_date)
+            currency_code = item.find('CharCode').text.strip()
+            name = item.find('Name').text.strip()
+        else:
+            record_date = _parse_cbr_date(item.get('Date'))
+            currency_code = CURRENCY['currency_code']
+            name = CURRENCY['name']
+        records.append(RateRecord(
+            record_date,
+            currency_code,
+            name,
+            Decimal(item.find('Value').text.replace(',', '.')),
+            int(item.find('Nominal').text),
+        ))
+    return records
+
+
+def _etree(data: bytes) -> int:
+    return len(_tree_records(ET.fromstring(data.decode('windows-1251'))))
+
+
+def _reencode(data: bytes) -> int:
+    return len(_tree_records(etree.fromstring(data.decode('windows-1251').encode('windows-1251'))))
+
+
+def _stream(data: bytes) -> int:
+    return len(parse_cbr_xml(data, CURRENCY))
+
+
+STRATEGIES = {
+    'etree': _etree,
+    'reencode': _reencode,
+    'stream': _stream,
+}
+
+
+def _memory_kb(field: str) -> int:
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith(field):
+            return int(line.split()[1])
+    return 0
+
+
+def _scaled(data: bytes, scale: int) -> bytes:
+    # Повторяем записи внутри корневого элемента, чтобы получить большой документ.
+    # Первый '>' закрывает XML-декларацию, второй - открывающий тег корня.
+    root_start = data.index(b'>', data.index(b'>') + 1) + 1
+    root_end = data.rindex(b'</')
+    return data[:root_start] + data[root_start:root_end] * scale + data[root_end:]
+
+
+def _run(strategy: str, path: str, scale: int, repeat: int) -> dict:
+    data = _scaled(Path(path).read_bytes(), scale)
+    parse = STRATEGIES[strategy]
+
+    rss_before = _memory_kb('VmRSS')
+    records = parse(data)
+    peak_kb = _memory_kb('VmHWM') - rss_before
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        parse(data)
+    elapsed = (time.perf_counter() - started) / repeat
+
+    return {
+        'file': Path(path).name,
+        'strategy': strategy,
+        'bytes': len(data),
+        'records': records,
+        'ms_per_doc': round(elapsed * 1000, 3),
+        'records_per_sec': round(records / elapsed),
+        'peak_memory_kb': peak_kb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', default='XML_daily.xml,XML_dynamic.xml')
+    parser.add_argument('--strategies', default='etree,reencode,stream')
+    parser.add_argument('--scale', type=int, default=1, help="во сколько раз размножить записи документа")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for file_name in args.files.split(','):
+        for strategy in args.strategies.split(','):
+            with context.Pool(1) as pool:
+                results.append(pool.apply(_run, (strategy, str(DATA_DIR / file_name), args.scale, args.repeat)))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'file':<18}{'strategy':<10}{'records':>9}{'ms/doc':>10}{'records/sec':>14}{'peak KB':>10}")
+    for r in results:
+        print(
+            f"{r['file']:<18}{r['strategy']:<10}{r['records']:>9}{r['ms_per_doc']:>10.3f}"
+            f"{r['records_per_sec']:>14}{r['peak_memory_kb']:>10}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Сравнение стратегий записи курсов в currency_rate.
+
+    row      - прежний вариант: отдельный INSERT ... ON CONFLICT на каждую валюту
+    bulk     - crud.save_rates: один multi-row upsert на пачку
+    copy     - crud.copy_rates: COPY во временную таблицу и один merge
+
+Скрипт пишет в базу из DATABASE_URL даты начиная с 1900-01-01 и удаляет их
+после каждого прогона, поэтому запускать его стоит на тестовой базе:
+
+    python -m benchmarks.bench_save_rates --days 250 --batch-days 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
+
+from app.crud import copy_rates, save_rates
+from app.database import AsyncSessionLocal, init_db, shutdown_db
+from app.models import CurrencyRate
+from app.partitions import ensure_rate_partitions
+from benchmarks.fixtures import business_days, daily_rates
+
+START_DATE = date(1900, 1, 1)
+
+
+async def _save_row_by_row(session, rates):
+    await ensure_rate_partitions(rate.date for rate in rates)
+    for rate in rates:
+        stmt = insert(CurrencyRate).values(
+            date=rate.date,
+            currency_code=rate.currency_code,
+            name=rate.name,
+            rate=rate.rate,
+            nominal=rate.nominal
+        ).on_conflict_do_update(
+            index_elements=['date', 'currency_code'],
+            set_={
+                'name': rate.name,
+                'rate': rate.rate,
+                'nominal': rate.nominal
+            }
+        )
+        await session.execute(stmt)
+    await session.commit()
+    return len(rates)
+
+
+STRATEGIES = {
+    'row': _save_row_by_row,
+    'bulk': save_rates,
+    'copy': copy_rates,
+}
+
+
+async def _cleanup(end_date: date):
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(CurrencyRate).where(CurrencyRate.date.between(START_DATE, end_date))
+        )
+        await session.commit()
+
+
+async def run(days: int, batch_days: int, strategies: list[str]) -> list[dict]:
+    end_date = START_DATE + timedelta(days=days * 7 // 5 + 7)
+    all_days = list(business_days(START_DATE, end_date))[:days]
+    batches = [
+        [rate for day in all_days[i:i + batch_days] for rate in daily_rates(day)]
+        for i in range(0, len(all_days), batch_days)
+    ]
+    total_rows = sum(len(batch) for batch in batches)
+
+    results = []
+    for name in strategies:
+        await _cleanup(end_date)
+        save = STRATEGIES[name]
+
+        started = time.perf_counter()
+        saved = 0
+        for batch in batches:
+            async with AsyncSessionLocal() as session:
+                saved += await save(session, batch)
+        elapsed = time.perf_counter() - started
+
+        results.append({
+            'strategy': name,
+            'days': len(all_days),
+            'rows': total_rows,
+            'saved': saved,
+            'seconds': round(elapsed, 4),
+            'rows_per_sec': round(total_rows / elapsed, 1),
+        })
+
+    await _cleanup(end_date)
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=250, help="число рабочих дней")
+    parser.add_argument('--batch-days', type=int, default=50, help="дней в одном вызове сохранения")
+    parser.add_argument('--strategies', default='row,bulk,copy')
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    await init_db()
+    try:
+        results = await run(args.days, args.batch_days, args.strategies.split(','))
+    finally:
+        await shutdown_db()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'strategy':<10}{'rows':>10}{'seconds':>12}{'rows/sec':>14}")
+    for result in results:
+        print(f"{result['strategy']:<10}{result['rows']:>10}{result['seconds']:>12.3f}{result['rows_per_sec']:>14.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+"""Стоимость ответа /exchange-rates: сериализация и чтение из базы.
+
+Сериализация (через ASGI-вызов приложения, без сети и базы):
+
+    response_model - прежний путь: список словарей -> CurrencyRateSchema -> JSONResponse
+    raw_cold       - RateSet.json() на новом наборе, то есть кодирование на каждый запрос
+    raw_cached     - RateSet.json() на закэшированном наборе: готовые байты
+
+Чтение набора курсов за дату (только с --db, нужна база из DATABASE_URL
+с курсами на --date):
+
+    orm            - select(CurrencyRate), ORM-объекты
+    core           - select по колонкам, строки-кортежи
+    prepared       - тот же запрос готовым SQL через app.queries (asyncpg.Record)
+
+    python -m benchmarks.bench_serialization --requests 5000
+    python -m benchmarks.bench_serialization --db --date 2024-06-03
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+from sqlalchemy import select
+
+from app.cache import RateSet
+from app.schemas import CurrencyRateSchema
+from benchmarks.fixtures import daily_rates
+
+FIXTURE_DATE = date(2024, 6, 3)
+
+
+def _rate_dicts() -> list[dict]:
+    return [rate._asdict() for rate in daily_rates(FIXTURE_DATE)]
+
+
+def _build_app() -> FastAPI:
+    app = FastAPI()
+    rates = _rate_dicts()
+    cached = RateSet(FIXTURE_DATE, rates)
+
+    @app.get("/response_model", response_model=list[CurrencyRateSchema])
+    async def response_model():
+        return rates
+
+    @app.get("/raw_cold", response_model=list[CurrencyRateSchema])
+    async def raw_cold():
+        return Response(RateSet(FIXTURE_DATE, rates).json(), media_type="application/json")
+
+    @app.get("/raw_cached", response_model=list[CurrencyRateSchema])
+    async def raw_cached():
+        return Response(cached.json(), media_type="application/json")
+
+    return app
+
+
+async def _call(app, path: str) -> bytes:
+    # Минимальный ASGI-клиент: меряем приложение, а не HTTP-стек
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'root_path': '', 'query_string': b'', 'headers': [], 'server': ('bench', 80),
+    }
+    body = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.body':
+            body.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    return b''.join(body)
+
+
+async def bench_serialization(requests: int, strategies: list[str]) -> list[dict]:
+    app = _build_app()
+    reference = None
+    results = []
+    for name in strategies:
+        body = await _call(app, f"/{name}")
+        # Все пути должны отдавать одни и те же байты
+        if reference is None:
+            reference = body
+        elif body != reference:
+            raise RuntimeError(f"{name} returned a different body")
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            await _call(app, f"/{name}")
+        elapsed = time.perf_counter() - started
+
+        results.append({
+            'strategy': name,
+            'requests': requests,
+            'us_per_request': round(elapsed / requests * 1e6, 1),
+            'requests_per_sec': round(requests / elapsed),
+        })
+    return results
+
+
+async def bench_read(target_date: date, repeat: int) -> list[dict]:
+    from app.database import AsyncSessionLocal, shutdown_db
+    from app.models import CurrencyRate
+    from app.queries import read_queries
+
+    columns = (
+        CurrencyRate.date,
+        CurrencyRate.currency_code,
+        CurrencyRate.name,
+        CurrencyRate.rate,
+        CurrencyRate.nominal,
+    )
+
+    async def orm(session):
+        result = await session.execute(select(CurrencyRate).where(CurrencyRate.date == target_date))
+        return [
+            {
+                'date': rate.date,
+                'currency_code': rate.currency_code,
+                'name': rate.name,
+                'rate': rate.rate,
+                'nominal': rate.nominal,
+            }
+            for rate in result.scalars().all()
+        ]
+
+    async def core(session):
+        result = await session.execute(select(*columns).where(CurrencyRate.date == target_date))
+        return [dict(rate) for rate in result.mappings().all()]
+
+    async def prepared(session):
+        return await read_queries.fetch(
+            "SELECT date, currency_code, name, rate, nominal FROM currency_rate WHERE date = $1",
+            target_date,
+        )
+
+    results = []
+    try:
+        for name, read in (('orm', orm), ('core', core), ('prepared', prepared)):
+            async with AsyncSessionLocal() as session:
+                rows = len(await read(session))
+                started = time.perf_counter()
+                for _ in range(repeat):
+                    await read(session)
+                    # Новые ORM-объекты, а не попадания в identity map
+                    session.expunge_all()
+                elapsed = time.perf_counter() - started
+
+            results.append({
+                'strategy': name,
+                'rows': rows,
+                'us_per_read': round(elapsed / repeat * 1e6, 1),
+            })
+    finally:
+        await shutdown_db()
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--strategies', default='response_model,raw_cold,raw_cached')
+    parser.add_argument('--db', action='store_true', help="сравнить также способы чтения из базы")
+    parser.add_argument('--date', type=date.fromisoformat, default=FIXTURE_DATE)
+    parser.add_argument('--json', action='store_true', help="вывести результат в JSON")
+    args = parser.parse_args()
+
+    results = {'serialization': await bench_serialization(args.requests, args.strategies.split(','))}
+    if args.db:
+        results['read'] = await bench_read(args.date, max(1, args.requests // 10))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'strategy':<16}{'us/request':>12}{'requests/sec':>15}")
+    for r in results['serialization']:
+        print(f"{r['strategy']:<16}{r['us_per_request']:>12.1f}{r['requests_per_sec']:>15}")
+    if args.db:
+        print(f"\n{'read':<16}{'rows':>6}{'us/read':>12}")
+        for r in results['read']:
+            print(f"{r['strategy']:<16}{r['rows']:>6}{r['us_per_read']:>12.1f}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,131 @@
+"""Локальная замена cbr.ru для нагрузочных тестов.
+
+Отдаёт XML_daily, XML_dynamic и XML_valFull из benchmarks.fixtures с
+настраиваемой задержкой и долей ответов 500. GET /_stub/stats - число
+запросов по путям, POST /_stub/reset - обнуление счётчиков.
+
+    python -m benchmarks.cbr_stub --port 8899 --latency 50 --failure-rate 0.05
+    CBR_BASE_URL=http://localhost:8899/scripts uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import random
+from collections import Counter
+from datetime import date, datetime
+from functools import lru_cache
+
+from aiohttp import web
+
+from benchmarks.fixtures import xml_daily, xml_dynamic, xml_val_full
+
+CONTENT_TYPE = 'application/xml'
+CHARSET = 'windows-1251'
+
+
+def _parse_cbr_date(value: str) -> date:
+    return datetime.strptime(value, '%d/%m/%Y').date()
+
+
+# Документы детерминированы, их достаточно построить один раз
+_daily = lru_cache(maxsize=4096)(xml_daily)
+_dynamic = lru_cache(maxsize=1024)(xml_dynamic)
+_val_full = lru_cache(maxsize=1)(xml_val_full)
+
+
+class CBRStub:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, failure_rate: float = 0.0):
+        # latency и jitter - в секундах
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.requests = Counter()
+        self.failures = Counter()
+
+    async def _respond(self, request: web.Request, build) -> web.Response:
+        self.requests[request.path] += 1
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.failure_rate and random.random() < self.failure_rate:
+            self.failures[request.path] += 1
+            return web.Response(status=500, text='stub failure')
+
+        try:
+            body = build(request.query)
+        except (KeyError, ValueError, StopIteration):
+            return web.Response(status=400, text='bad request')
+        return web.Response(body=body, content_type=CONTENT_TYPE, charset=CHARSET)
+
+    async def daily(self, request: web.Request) -> web.Response:
+        return await self._respond(
+            request,
+            lambda query: _daily(_parse_cbr_date(query['date_req']) if 'date_req' in query else date.today()),
+        )
+
+    async def dynamic(self, request: web.Request) -> web.Response:
+        return await self._respond(
+            request,
+            lambda query: _dynamic(
+                query['VAL_NM_RQ'],
+                _parse_cbr_date(query['date_req1']),
+                _parse_cbr_date(query['date_req2']),
+            ),
+        )
+
+    async def val_full(self, request: web.Request) -> web.Response:
+        return await self._respond(request, lambda query: _val_full())
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats_dict())
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.reset_counters()
+        return web.json_response(self.stats_dict())
+
+    def stats_dict(self) -> dict:
+        return {
+            'requests': dict(self.requests),
+            'failures': dict(self.failures),
+            'total': sum(self.requests.values()),
+        }
+
+    def reset_counters(self) -> None:
+        self.requests.clear()
+        self.failures.clear()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/scripts/XML_daily.asp', self.daily)
+        app.router.add_get('/scripts/XML_dynamic.asp', self.dynamic)
+        app.router.add_get('/scripts/XML_valFull.asp', self.val_full)
+        app.router.add_get('/_stub/stats', self.stats)
+        app.router.add_post('/_stub/reset', self.reset)
+        return app
+
+
+async def start_stub(stub: CBRStub, host: str = '127.0.0.1', port: int = 0) -> tuple[web.AppRunner, str]:
+    """Запуск заглушки в текущем цикле событий. Возвращает runner и базовый
+    URL для CBR_BASE_URL (port=0 - любой свободный порт)."""
+    runner = web.AppRunner(stub.build_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}/scripts"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, мс")
+    parser.add_argument('--jitter', type=float, default=0.0, help="случайная добавка к задержке, мс")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="доля ответов 500, от 0 до 1")
+    args = parser.parse_args()
+
+    stub = CBRStub(args.latency / 1000, args.jitter / 1000, args.failure_rate)
+    web.run_app(stub.build_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Детерминированные тестовые данные в формате ЦБ РФ.
+
+    python -m benchmarks.fixtures   - перезаписать файлы в benchmarks/data
+"""
+import hashlib
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from app.cbr_parser import RateRecord
+
+# (ID ЦБ, цифровой код, буквенный код, номинал, название, базовый курс)
+CURRENCIES = [
+    ('R01010', '036', 'AUD', 1, 'Австралийский доллар', '52.1830'),
+    ('R01020A', '944', 'AZN', 1, 'Азербайджанский манат', '47.4260'),
+    ('R01035', '826', 'GBP', 1, 'Фунт стерлингов Соединенного королевства', '107.9522'),
+    ('R01060', '051', 'AMD', 100, 'Армянских драмов', '20.8760'),
+    ('R01090B', '933', 'BYN', 1, 'Белорусский рубль', '24.6630'),
+    ('R01100', '975', 'BGN', 1, 'Болгарский лев', '47.9810'),
+    ('R01115', '986', 'BRL', 1, 'Бразильский реал', '14.5620'),
+    ('R01135', '348', 'HUF', 100, 'Венгерских форинтов', '23.9040'),
+    ('R01150', '704', 'VND', 10000, 'Вьетнамских донгов', '30.7720'),
+    ('R01200', '344', 'HKD', 1, 'Гонконгский доллар', '10.3710'),
+    ('R01210', '981', 'GEL', 1, 'Грузинский лари', '29.7010'),
+    ('R01215', '208', 'DKK', 1, 'Датская крона', '12.5790'),
+    ('R01230', '784', 'AED', 1, 'Дирхам ОАЭ', '21.9530'),
+    ('R01235', '840', 'USD', 1, 'Доллар США', '80.6234'),
+    ('R01239', '978', 'EUR', 1, 'Евро', '93.8120'),
+    ('R01240', '818', 'EGP', 10, 'Египетских фунтов', '16.6390'),
+    ('R01270', '356', 'INR', 100, 'Индийских рупий', '91.8780'),
+    ('R01280', '360', 'IDR', 10000, 'Индонезийских рупий', '48.6210'),
+    ('R01335', '398', 'KZT', 100, 'Казахстанских тенге', '14.9470'),
+    ('R01350', '124', 'CAD', 1, 'Канадский доллар', '57.4930'),
+    ('R01355', '634', 'QAR', 1, 'Катарский риал', '22.1490'),
+    ('R01370', '417', 'KGS', 100, 'Киргизских сомов', '92.1960'),
+    ('R01375', '156', 'CNY', 1, 'Юань', '11.2680'),
+    ('R01500', '498', 'MDL', 10, 'Молдавских леев', '47.2120'),
+    ('R01530', '554', 'NZD', 1, 'Новозеландский доллар', '46.3570'),
+    ('R01535', '578', 'NOK', 10, 'Норвежских крон', '79.8650'),
+    ('R01565', '985', 'PLN', 1, 'Польский злотый', '21.9950'),
+    ('R01585F', '946', 'RON', 1, 'Румынский лей', '18.4320'),
+    ('R01589', '960', 'XDR', 1, 'СДР (специальные права заимствования)', '109.9780'),
+    ('R01625', '702', 'SGD', 1, 'Сингапурский доллар', '62.0860'),
+    ('R01670', '972', 'TJS', 10, 'Таджикских сомони', '86.7250'),
+    ('R01675', '764', 'THB', 10, 'Таиландских батов', '24.7040'),
+    ('R01700J', '949', 'TRY', 10, 'Турецких лир', '19.3030'),
+    ('R01710A', '934', 'TMT', 1, 'Новый туркменский манат', '23.0350'),
+    ('R01717', '860', 'UZS', 10000, 'Узбекских сумов', '66.7930'),
+    ('R01720', '980', 'UAH', 10, 'Украинских гривен', '19.3990'),
+    ('R01760', '203', 'CZK', 10, 'Чешских крон', '38.6110'),
+    ('R01770', '752', 'SEK', 10, 'Шведских крон', '85.7280'),
+    ('R01775', '756', 'CHF', 1, 'Швейцарский франк', '100.7940'),
+    ('R01805F', '941', 'RSD', 100, 'Сербских динаров', '80.0690'),
+    ('R01810', '710', 'ZAR', 10, 'Южноафриканских рэндов', '46.5180'),
+    ('R01815', '410', 'KRW', 1000, 'Вон Республики Корея', '57.0320'),
+    ('R01820', '392', 'JPY', 100, 'Японских иен', '53.3640'),
+]
+
+
+def effective_date(day: date) -> date:
+    """Дата, которую ЦБ вернёт на запрос за day: в выходные - пятница."""
+    if day.weekday() >= 5:
+        return day - timedelta(days=day.weekday() - 4)
+    return day
+
+
+def _jitter(code: str, day: date) -> Decimal:
+    digest = hashlib.blake2b(f"{code}:{day.isoformat()}".encode(), digest_size=2).digest()
+    # отклонение от базового курса в пределах +-5%
+    return Decimal(int.from_bytes(digest, 'big') % 1001 - 500) / Decimal(10000)
+
+
+def _rate(code: str, base: str, day: date) -> Decimal:
+    return (Decimal(base) * (1 + _jitter(code, day))).quantize(Decimal('0.0001'))
+
+
+def daily_rates(day: date) -> list[RateRecord]:
+    """Курсы всех валют на дату в том виде, в каком их возвращает fetch_cbr_rates."""
+    day = effective_date(day)
+    return [
+        RateRecord(day, code, name, _rate(code, base, day), nominal)
+        for _, _, code, nominal, name, base in CURRENCIES
+    ]
+
+
+def business_days(start: date, end: date):
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+def _cbr_value(value: Decimal) -> str:
+    return str(value).replace('.', ',')
+
+
+def _xml(parts: list[str]) -> bytes:
+    return ('<?xml version="1.0" encoding="windows-1251"?>' + ''.join(parts)).encode('windows-1251')
+
+
+def xml_daily(day: date) -> bytes:
+    """Ответ XML_daily.asp?date_req=day."""
+    day = effective_date(day)
+    parts = [f'<ValCurs Date="{day:%d.%m.%Y}" name="Foreign Currency Market">']
+    for cbr_id, num_code, code, nominal, name, base in CURRENCIES:
+        rate = _rate(code, base, day)
+        parts.append(
+            f'<Valute ID="{cbr_id}"><NumCode>{num_code}</NumCode><CharCode>{code}</CharCode>'
+            f'<Nominal>{nominal}</Nominal><Name>{escape(name)}</Name><Value>{_cbr_value(rate)}</Value>'
+            f'<VunitRate>{_cbr_value(rate / nominal)}</VunitRate></Valute>'
+        )
+    parts.append('</ValCurs>')
+    return _xml(parts)
+
+
+def xml_dynamic(cbr_id: str, start: date, end: date) -> bytes:
+    """Ответ XML_dynamic.asp по одной валюте за диапазон дат."""
+    _, _, code, nominal, _, base = next(c for c in CURRENCIES if c[0] == cbr_id)
+    parts = [
+        f'<ValCurs ID="{cbr_id}" DateRange1="{start:%d.%m.%Y}" DateRange2="{end:%d.%m.%Y}" '
+        f'name="Foreign Currency Market Dynamic">'
+    ]
+    for day in business_days(start, end):
+        rate = _rate(code, base, day)
+        parts.append(
+            f'<Record Date="{day:%d.%m.%Y}" Id="{cbr_id}"><Nominal>{nominal}</Nominal>'
+            f'<Value>{_cbr_value(rate)}</Value><VunitRate>{_cbr_value(rate / nominal)}</VunitRate></Record>'
+        )
+    parts.append('</ValCurs>')
+    return _xml(parts)
+
+
+def xml_val_full() -> bytes:
+    """Ответ XML_valFull.asp: справочник валют."""
+    parts = ['<Valuta name="Foreign Currency Market Lib">']
+    for cbr_id, num_code, code, nominal, name, _ in CURRENCIES:
+        parts.append(
+            f'<Item ID="{cbr_id}"><Name>{escape(name)}</Name><EngName></EngName><Nominal>{nominal}</Nominal>'
+            f'<ParentCode>{cbr_id:<10}</ParentCode><ISO_Num_Code>{num_code}</ISO_Num_Code>'
+            f'<ISO_Char_Code>{code}</ISO_Char_Code></Item>'
+        )
+    parts.append('</Valuta>')
+    return _xml(parts)
+
+
+DATA_DIR = Path(__file__).parent / 'data'
+
+FIXTURE_FILES = {
+    'XML_daily.xml': lambda: xml_daily(date(2024, 6, 3)),
+    'XML_dynamic.xml': lambda: xml_dynamic('R01235', date(2015, 1, 1), date(2024, 12, 31)),
+    'XML_valFull.xml': xml_val_full,
+}
+
+
+def write_fixture_files() -> None:
+    DATA_DIR.mkdir(exist_ok=True)
+    for file_name, build in FIXTURE_FILES.items():
+        (DATA_DIR / file_name).write_bytes(build())
+
+
+if __name__ == '__main__':
+    write_fixture_files()
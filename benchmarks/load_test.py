@@ -0,0 +1,413 @@
+"""Нагрузочный тест сервиса против локальной заглушки ЦБ.
+
+Поднимает заглушку cbr.ru (benchmarks.cbr_stub) и настоящий app.main:app
+(benchmarks.serve, отдельный процесс), гоняет сценарии и сохраняет
+результат в JSON:
+
+    cold_day          - сегодняшних курсов нет ни в кэше, ни в базе
+    warm_day          - сегодняшние курсы уже загружены: /exchange-rates,
+                        /exchange-rates/{code}, /convert
+    warm_exporting    - то же, пока в фоне непрерывно идут полные выгрузки
+                        /exports/rates (CSV с gzip и Arrow)
+    weekend           - запросы на субботу и воскресенье (курсы пятницы)
+    backfill_daily    - python -m app.backfill --mode daily
+    backfill_dynamic  - python -m app.backfill --mode dynamic
+
+По каждому сценарию: p50/p95/p99 задержки, запросы в секунду, статусы
+ответов, число запросов к ЦБ и к базе. Тест удаляет и перезаписывает
+курсы на сегодня, на выходные 2000-01-07..09 и на бэкфилл-диапазон с
+1995-01-01, поэтому DATABASE_URL должен указывать на тестовую базу:
+
+    python -m benchmarks.load_test --requests 2000 --concurrency 50
+    python -m benchmarks.load_test --stub-latency 100 --stub-failure-rate 0.1 --scenarios cold_day
+    python -m benchmarks.load_test --compare benchmarks/results/a.json benchmarks/results/b.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import aiohttp
+from sqlalchemy import event, text
+
+from benchmarks.cbr_stub import CBRStub, start_stub
+from benchmarks.fixtures import CURRENCIES, effective_date
+
+RESULTS_DIR = Path(__file__).parent / 'results'
+SCENARIOS = ('cold_day', 'warm_day', 'warm_exporting', 'weekend', 'backfill_daily', 'backfill_dynamic')
+
+# Пятница, суббота, воскресенье
+WEEKEND = (date(2000, 1, 7), date(2000, 1, 8), date(2000, 1, 9))
+BACKFILL_START = date(1995, 1, 1)
+CODES = [currency[2] for currency in CURRENCIES]
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+class AppServer:
+    """benchmarks.serve в отдельном процессе: нагрузка и сервис не делят CPU."""
+
+    def __init__(self, port: int, cbr_base_url: str):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = {
+            **os.environ,
+            'CBR_BASE_URL': cbr_base_url,
+            'PREFETCH_ENABLED': '0',
+        }
+        self._process: subprocess.Popen | None = None
+
+    async def start(self, session: aiohttp.ClientSession) -> None:
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'benchmarks.serve', '--port', str(self.port)],
+            env=self.env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"App server exited with code {self._process.returncode}")
+            try:
+                async with session.get(f"{self.url}/") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError("App server did not start in 30s")
+
+    def stop(self) -> None:
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait(timeout=10)
+        self._process = None
+
+    async def restart(self, session: aiohttp.ClientSession) -> None:
+        # Новый процесс - пустые кэши в памяти
+        self.stop()
+        await self.start(session)
+
+    async def queries(self, session: aiohttp.ClientSession) -> int:
+        async with session.get(f"{self.url}/_bench/stats") as response:
+            return (await response.json())['queries']
+
+
+async def _drive(session: aiohttp.ClientSession, base_url: str, next_path, requests: int, concurrency: int) -> dict:
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            path = next_path()
+            started = time.perf_counter()
+            try:
+                async with session.get(base_url + path) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(requests / elapsed, 1),
+        'latency_ms': {
+            'p50': _percentile(latencies, 0.50),
+            'p95': _percentile(latencies, 0.95),
+            'p99': _percentile(latencies, 0.99),
+            'max': _percentile(latencies, 1.0),
+        },
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'errors': dict(errors),
+    }
+
+
+async def _measure_load(ctx, next_path) -> dict:
+    stub, server, session, args = ctx['stub'], ctx['server'], ctx['session'], ctx['args']
+    stub.reset_counters()
+    queries_before = await server.queries(session)
+
+    result = await _drive(session, server.url, next_path, args.requests, args.concurrency)
+
+    result['upstream_calls'] = stub.stats_dict()
+    result['db_queries'] = await server.queries(session) - queries_before
+    return result
+
+
+async def _delete_dates(dates) -> None:
+    from app.database import AsyncSessionLocal
+
+    dates = list(dates)
+    async with AsyncSessionLocal() as session:
+        for table, column in (
+            ('currency_rate', 'date'),
+            ('rate_effective_date', 'requested_date'),
+            ('rate_snapshot', 'date'),
+        ):
+            await session.execute(text(f"DELETE FROM {table} WHERE {column} = ANY(:dates)"), {'dates': dates})
+        await session.commit()
+
+
+async def _delete_range(start: date, end: date) -> None:
+    await _delete_dates(start + timedelta(days=offset) for offset in range((end - start).days + 1))
+
+
+async def scenario_cold_day(ctx) -> dict:
+    today = date.today()
+    await _delete_dates({today, effective_date(today)})
+    await ctx['server'].restart(ctx['session'])
+    return await _measure_load(ctx, lambda: "/exchange-rates")
+
+
+async def scenario_warm_day(ctx) -> dict:
+    # Прогрев на случай, если сценарий запущен без cold_day
+    async with ctx['session'].get(f"{ctx['server'].url}/exchange-rates") as response:
+        await response.read()
+
+    def next_path():
+        kind = random.random()
+        if kind < 0.4:
+            return "/exchange-rates"
+        if kind < 0.8:
+            return f"/exchange-rates/{random.choice(CODES)}"
+        return f"/convert?from={random.choice(CODES)}&to={random.choice(CODES)}&amount=100"
+
+    return await _measure_load(ctx, next_path)
+
+
+async def scenario_warm_exporting(ctx) -> dict:
+    session, url = ctx['session'], ctx['server'].url
+    stop = asyncio.Event()
+    exports = []
+
+    async def export(params: dict, headers: dict):
+        while not stop.is_set():
+            started = time.perf_counter()
+            async with session.get(f"{url}/exports/rates", params=params, headers=headers,
+                                   auto_decompress=False) as response:
+                async for _ in response.content.iter_any():
+                    pass
+            exports.append(time.perf_counter() - started)
+
+    tasks = [
+        asyncio.create_task(export({'format': 'csv'}, {'Accept-Encoding': 'gzip'})),
+        asyncio.create_task(export({'format': 'arrow'}, {})),
+    ]
+    try:
+        result = await scenario_warm_day(ctx)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    exports.sort()
+    result['exports'] = {'count': len(exports), 'p50_ms': _percentile(exports, 0.5)}
+    return result
+
+
+async def _run_backfill(ctx, start: date, end: date, mode: str) -> dict:
+    from app.backfill import backfill
+    from app.cbr_client import cbr_client
+
+    cbr_client.base_url = ctx['stub_url']
+    await cbr_client.start()
+    try:
+        return await backfill(start, end, mode, concurrency=ctx['args'].backfill_concurrency, rps=0)
+    finally:
+        await cbr_client.close()
+
+
+async def scenario_weekend(ctx) -> dict:
+    await _delete_dates(WEEKEND)
+    await _run_backfill(ctx, WEEKEND[0], WEEKEND[-1], 'daily')
+    await ctx['server'].restart(ctx['session'])
+
+    def next_path():
+        day = random.choice(WEEKEND[1:]).isoformat()
+        if random.random() < 0.7:
+            return f"/exchange-rates/{random.choice(CODES)}?date={day}"
+        return f"/convert?from={random.choice(CODES)}&to={random.choice(CODES)}&date={day}"
+
+    return await _measure_load(ctx, next_path)
+
+
+async def _scenario_backfill(ctx, mode: str) -> dict:
+    from app.database import engine
+
+    end = BACKFILL_START + timedelta(days=ctx['args'].backfill_days - 1)
+    await _delete_range(BACKFILL_START, end)
+
+    queries = 0
+
+    def count_query(*args):
+        nonlocal queries
+        queries += 1
+
+    ctx['stub'].reset_counters()
+    event.listen(engine.sync_engine, "before_cursor_execute", count_query)
+    try:
+        report = await _run_backfill(ctx, BACKFILL_START, end, mode)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_query)
+
+    report['upstream_calls'] = ctx['stub'].stats_dict()
+    report['db_queries'] = queries
+    return report
+
+
+async def scenario_backfill_daily(ctx) -> dict:
+    return await _scenario_backfill(ctx, 'daily')
+
+
+async def scenario_backfill_dynamic(ctx) -> dict:
+    return await _scenario_backfill(ctx, 'dynamic')
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from app.database import shutdown_db
+
+    stub = CBRStub(args.stub_latency / 1000, args.stub_jitter / 1000, args.stub_failure_rate)
+    runner, stub_url = await start_stub(stub)
+    server = AppServer(args.port, stub_url)
+
+    results = {
+        'meta': {
+            'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'args': vars(args),
+        },
+        'scenarios': {},
+    }
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        ctx = {'args': args, 'stub': stub, 'stub_url': stub_url, 'server': server, 'session': session}
+        try:
+            await server.start(session)
+            for name in args.scenarios.split(','):
+                print(f"Running {name}...", file=sys.stderr)
+                results['scenarios'][name] = await globals()[f"scenario_{name}"](ctx)
+        finally:
+            server.stop()
+            await runner.cleanup()
+            await shutdown_db()
+
+    return results
+
+
+def _summary_row(name: str, result: dict) -> str:
+    latency = result.get('latency_ms')
+    if latency is None:
+        # Бэкфилл
+        return (
+            f"{name:<18}{'':>9}{'':>9}{'':>9}{result['rows_per_sec']:>10} rows/s"
+            f"{result['upstream_calls']['total']:>10}{result['db_queries']:>9}"
+        )
+    return (
+        f"{name:<18}{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}{result['requests_per_sec']:>10} req/s"
+        f"{result['upstream_calls']['total']:>11}{result['db_queries']:>9}"
+    )
+
+
+def print_summary(results: dict) -> None:
+    print(f"{'scenario':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'throughput':>17}{'upstream':>10}{'queries':>9}")
+    for name, result in results['scenarios'].items():
+        print(_summary_row(name, result))
+
+
+def _metrics(result: dict) -> dict:
+    metrics = {
+        'upstream_calls': result['upstream_calls']['total'],
+        'db_queries': result['db_queries'],
+    }
+    if 'latency_ms' in result:
+        metrics.update({f"{key}_ms": value for key, value in result['latency_ms'].items()})
+        metrics['requests_per_sec'] = result['requests_per_sec']
+    else:
+        metrics['rows_per_sec'] = result['rows_per_sec']
+        metrics['seconds'] = result['seconds']
+    return metrics
+
+
+def compare(base_path: Path, new_path: Path) -> None:
+    base = json.loads(base_path.read_text())
+    new = json.loads(new_path.read_text())
+    print(f"{base_path.name} ({base['meta']['commit']}) -> {new_path.name} ({new['meta']['commit']})")
+    for name, new_result in new['scenarios'].items():
+        base_result = base['scenarios'].get(name)
+        if base_result is None:
+            continue
+        print(f"\n{name}")
+        base_metrics = _metrics(base_result)
+        for metric, value in _metrics(new_result).items():
+            old = base_metrics.get(metric)
+            change = f"{(value - old) / old * 100:+.1f}%" if old else ""
+            print(f"  {metric:<18}{old!s:>12}{value!s:>12}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help="запросов на сценарий")
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременных клиентов")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--stub-latency', type=float, default=50.0, help="задержка заглушки ЦБ, мс")
+    parser.add_argument('--stub-jitter', type=float, default=20.0, help="случайная добавка к задержке, мс")
+    parser.add_argument('--stub-failure-rate', type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument('--backfill-days', type=int, default=90)
+    parser.add_argument('--backfill-concurrency', type=int, default=8)
+    parser.add_argument('--output', type=Path, help="файл результата, по умолчанию benchmarks/results/<время>.json")
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BASE', 'NEW'), help="сравнить два результата")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    unknown = set(args.scenarios.split(',')) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = asyncio.run(run(args))
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2, default=str))
+
+    print_summary(results)
+    print(f"\nSaved to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""app.main:app под uvicorn со счётчиком SQL-запросов для нагрузочных тестов.
+
+GET /_bench/stats отдаёт число выполненных запросов к базе: через
+SQLAlchemy на обоих движках и готовым SQL через app.queries. COPY из
+copy_rates и выгрузок идёт мимо них и не считается.
+
+    python -m benchmarks.serve --port 8765
+"""
+import argparse
+
+import uvicorn
+from sqlalchemy import event
+
+from app.database import ENGINES
+from app.main import app
+from app.queries import primary_queries, read_queries
+
+_queries = 0
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global _queries
+    _queries += 1
+
+
+for _engine in ENGINES.values():
+    event.listen(_engine.sync_engine, "before_cursor_execute", _count_query)
+
+
+@app.get("/_bench/stats", include_in_schema=False)
+async def bench_stats():
+    return {"queries": _queries + read_queries.queries + primary_queries.queries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()